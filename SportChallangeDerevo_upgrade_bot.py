@@ -1,14 +1,38 @@
 import asyncio
+import contextlib
+import contextvars
 import logging
-from datetime import datetime, timedelta, time
-from typing import Dict, Any, List, Optional
+from array import array
+import bisect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+import functools
+import hashlib
 import json
 import os
+import secrets
+import sqlite3
+import subprocess
+import sys
+import threading
+import time as time_module
+import weakref
+import httpx
 import pytz
+import signal
 from enum import Enum
 
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, JobQueue
+try:
+    import numpy as np
+except ImportError:  # BulkProgress falls back to per-challenge progress
+    np = None
+
+from telegram import Bot, Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, JobQueue, TypeHandler, BaseUpdateProcessor, ExtBot
+from telegram.request import HTTPXRequest
 
 # Configure logging
 logging.basicConfig(
@@ -21,7 +45,253 @@ logger = logging.getLogger(__name__)
 import os
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 # Data storage file
-DATA_FILE = "fitness_challenge_data.json"
+DATA_FILE = os.getenv('DATA_FILE', "fitness_challenge_data.json")
+
+# Storage mode: 'json' rewrites DATA_FILE on every change, 'journal' appends
+# each change to JOURNAL_FILE and only rewrites DATA_FILE on compaction
+STORAGE_MODE = os.getenv('STORAGE_MODE', 'json')
+JOURNAL_FILE = os.getenv('JOURNAL_FILE', DATA_FILE + '.journal')
+JOURNAL_COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', '1000'))
+# 'sqlite' keeps users, challenges and daily records in normalized tables
+SQLITE_FILE = os.getenv('SQLITE_FILE', "fitness_challenge_data.db")
+# 'sharded' keeps one JSON file per user under a hashed directory tree
+SHARD_DIR = os.getenv('SHARD_DIR', "fitness_challenge_users")
+# Users the lazy engines (sqlite, sharded) keep in memory before evicting the least
+# recently used ones (0 = no limit); keep it above REMINDER_BATCH_SIZE
+LAZY_CACHE_USERS = int(os.getenv('LAZY_CACHE_USERS', '10000'))
+# 'timezone' fires reminders at each user's local reminder_times via a per-minute
+# job; 'global' keeps the old 09:00/20:00 server-time sweeps over every user
+REMINDER_SCHEDULE = os.getenv('REMINDER_SCHEDULE', 'timezone')
+# How many missed minutes the per-minute reminder job catches up on
+REMINDER_CATCHUP_MINUTES = int(os.getenv('REMINDER_CATCHUP_MINUTES', '60'))
+# Reminder fan-out: concurrent senders, Telegram's ~30 msg/s bot-wide and
+# 1 msg/s per chat limits, and retries for flood control / network errors
+REMINDER_WORKERS = int(os.getenv('REMINDER_WORKERS', '16'))
+REMINDER_GLOBAL_RATE = float(os.getenv('REMINDER_GLOBAL_RATE', '30'))
+REMINDER_CHAT_RATE = float(os.getenv('REMINDER_CHAT_RATE', '1'))
+REMINDER_MAX_RETRIES = int(os.getenv('REMINDER_MAX_RETRIES', '3'))
+# Users whose reminder texts are computed together in one vectorized pass
+REMINDER_BATCH_SIZE = int(os.getenv('REMINDER_BATCH_SIZE', '5000'))
+# Append-only record of delivered reminders, so restarts resume without double-sending
+REMINDER_LEDGER_FILE = os.getenv('REMINDER_LEDGER_FILE', DATA_FILE + '.reminders')
+# Number of older checksummed snapshots kept next to DATA_FILE (DATA_FILE.1, .2, ...)
+SNAPSHOT_GENERATIONS = int(os.getenv('SNAPSHOT_GENERATIONS', '3'))
+# When > 0, changes are buffered and flushed by a background task at most this often
+WRITE_BEHIND_MS = int(os.getenv('WRITE_BEHIND_MS', '0'))
+# Updates processed at once; chats still see their own updates applied in order (1 = sequential)
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '1'))
+# Bot API endpoint; point it at benchmarks/fake_bot_api.py for local runs
+BOT_API_URL = os.getenv('BOT_API_URL', 'https://api.telegram.org/bot')
+# 'polling' (getUpdates) or 'webhook' (Telegram POSTs updates to an embedded HTTP server)
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', os.getenv('PORT', '8443')))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+# Public https URL of the proxy that terminates TLS and forwards to WEBHOOK_LISTEN:WEBHOOK_PORT;
+# when unset the webhook is not registered (e.g. every worker but one behind a load balancer)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+# Sent back by Telegram in X-Telegram-Bot-Api-Secret-Token; other requests are rejected
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Multi-process mode: with WORKER_COUNT > 1 this process becomes a front dispatcher that
+# polls Telegram and forwards each update to one of WORKER_COUNT worker processes, picked
+# by consistent hash of the user id. Worker i owns its own data files (suffixed .shard<i>,
+# worker 0 keeps the plain names) and sends its own users' reminders.
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', '1'))
+WORKER_INDEX = int(os.environ['WORKER_INDEX']) if os.getenv('WORKER_INDEX') else None
+# Worker i takes forwarded updates on 127.0.0.1:WORKER_BASE_PORT+i
+WORKER_BASE_PORT = int(os.getenv('WORKER_BASE_PORT', '8600'))
+WORKER_SECRET = os.getenv('WORKER_SECRET', '')
+# Points per worker on the hash ring; more points spread users more evenly
+RING_VNODES = int(os.getenv('RING_VNODES', '64'))
+# Worker count the data files are currently split for; resizing rebalances on startup
+WORKER_STATE_FILE = os.getenv('WORKER_STATE_FILE', DATA_FILE + '.workers')
+# Workers send with the same bot token, so each gets an equal share of the bot-wide rate
+REMINDER_PROCESS_RATE = (REMINDER_GLOBAL_RATE / WORKER_COUNT if WORKER_INDEX is not None
+                         else REMINDER_GLOBAL_RATE)
+# Port for the Prometheus /metrics endpoint (0 = off); worker i serves on METRICS_PORT+i
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+# Trace every update and log those slower than this many milliseconds with their
+# span breakdown (0 = tracing off)
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '0'))
+
+class Metric:
+    """A metric family in Prometheus text format, one series per label combination"""
+    
+    kind = 'untyped'
+    
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.series: Dict[tuple, Any] = {}
+    
+    def _label_text(self, values: tuple, extra: str = '') -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in sorted(self.series.items()):
+            lines.extend(self._render_series(values, value))
+        return lines
+    
+    def _render_series(self, values: tuple, value) -> List[str]:
+        return [f"{self.name}{self._label_text(values)} {value}"]
+
+class Counter(Metric):
+    kind = 'counter'
+    
+    def inc(self, amount: float = 1, *labels):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+    
+    def set(self, value: float, *labels):
+        self.series[labels] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+    
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            # Per-bucket counts (not cumulative) plus +Inf, then the sum
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+    
+    def time(self, *labels) -> 'HistogramTimer':
+        return HistogramTimer(self, labels)
+    
+    def _render_series(self, values: tuple, value) -> List[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+            lines.append(f"{self.name}_bucket{self._label_text(values, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(values)} {total}")
+        lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+class HistogramTimer:
+    """Context manager observing the seconds spent inside it"""
+    
+    __slots__ = ('histogram', 'labels', 'started')
+    
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.started = time_module.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time_module.perf_counter() - self.started, *self.labels)
+
+UPDATES = Counter('fitness_updates_total', 'Updates received, by kind', ('kind',))
+HANDLER_SECONDS = Histogram('fitness_handler_seconds', 'Time spent in update handlers, including waiting for the user lock', ('handler',))
+MENU_ACTION_SECONDS = Histogram('fitness_menu_action_seconds', 'Time spent per routed text action', ('action',))
+REPS_LOGGED = Counter('fitness_reps_logged_total', 'Reps logged by users')
+REP_ENTRIES = Counter('fitness_rep_entries_total', 'Add-reps entries recorded')
+CHALLENGES_CREATED = Counter('fitness_challenges_created_total', 'Challenges created')
+STORAGE_FLUSH_SECONDS = Histogram('fitness_storage_flush_seconds', 'Time spent writing changes to storage', ('engine', 'op'))
+STORAGE_FLUSH_BYTES = Counter('fitness_storage_flush_bytes_total', 'Bytes written to storage files', ('engine', 'op'))
+REMINDER_RUN_SECONDS = Histogram('fitness_reminder_run_seconds', 'Duration of reminder runs', ('kind',))
+REMINDERS = Counter('fitness_reminders_total', 'Reminder targets by outcome', ('outcome',))
+REMINDER_THROUGHPUT = Gauge('fitness_reminder_last_run_messages_per_second', 'Send rate of the last reminder run', ('kind',))
+METRICS = [UPDATES, HANDLER_SECONDS, MENU_ACTION_SECONDS, REPS_LOGGED, REP_ENTRIES,
+           CHALLENGES_CREATED, STORAGE_FLUSH_SECONDS, STORAGE_FLUSH_BYTES,
+           REMINDER_RUN_SECONDS, REMINDERS, REMINDER_THROUGHPUT]
+
+def render_metrics() -> str:
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+async def serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Answer one HTTP request with the metrics page (any path)"""
+    try:
+        while (await reader.readline()).strip():
+            pass  # request line and headers are not needed
+        body = render_metrics().encode()
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                     + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+class UpdateTrace:
+    """Time spent per span (lock, dispatch, storage, progress, telegram.<method>) in one update"""
+    
+    __slots__ = ('started', 'spans')
+    
+    def __init__(self):
+        self.started = time_module.perf_counter()
+        self.spans: Dict[str, list] = {}
+    
+    def add(self, name: str, seconds: float):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            span[0] += seconds
+            span[1] += 1
+    
+    def breakdown(self, total: float) -> str:
+        """Spans in the order they first ran; 'render' is the time outside all spans"""
+        parts = [f"{name} {seconds * 1000:.1f}ms" + (f" x{count}" if count > 1 else '')
+                 for name, (seconds, count) in self.spans.items()]
+        other = total - sum(seconds for seconds, _ in self.spans.values())
+        parts.append(f"render {other * 1000:.1f}ms")
+        return ', '.join(parts)
+
+class TraceSpan:
+    """Context manager adding the seconds spent inside it to a trace"""
+    
+    __slots__ = ('trace', 'name', 'started')
+    
+    def __init__(self, trace: UpdateTrace, name: str):
+        self.trace = trace
+        self.name = name
+    
+    def __enter__(self):
+        self.started = time_module.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.trace.add(self.name, time_module.perf_counter() - self.started)
+
+# The trace of the update being handled; asyncio tasks each see their own
+CURRENT_TRACE: contextvars.ContextVar = contextvars.ContextVar('current_trace', default=None)
+NO_SPAN = contextlib.nullcontext()
+
+def trace_span(name: str):
+    """Time a block into the current update's trace; a no-op outside traced updates"""
+    trace = CURRENT_TRACE.get()
+    if trace is None:
+        return NO_SPAN
+    return TraceSpan(trace, name)
+
+class TracedRequest(HTTPXRequest):
+    """HTTPXRequest recording each Bot API call as a telegram.<method> span"""
+    
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        with trace_span('telegram.' + url.rsplit('/', 1)[-1]):
+            return await super().do_request(url, method, *args, **kwargs)
 
 class ExerciseType(Enum):
     PUSHUPS = "push-ups"
@@ -65,141 +335,1688 @@ EXERCISE_INFO = {
     }
 }
 
-class FitnessChallengeBot:
-    def __init__(self):
-        self.user_data = self.load_data()
+def parse_datetime(value) -> Optional[datetime]:
+    """Parse a stored ISO date (datetimes and None pass through)"""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+@functools.lru_cache(maxsize=None)
+def day_key(ordinal: int) -> str:
+    """'YYYY-MM-DD' for a date ordinal; the same few hundred days recur across all users"""
+    return date.fromordinal(ordinal).isoformat()
+
+class Challenge:
+    """A single challenge; kept slotted in memory, stored as a plain dict.
+    
+    Reps per day live in `daily_reps`, an array('I') indexed by days since
+    `first_day` (a date ordinal, normally the start date), and are exported as
+    the usual {'YYYY-MM-DD': reps} `daily_records` dict.
+    
+    Streak and per-day aggregates are derived from `daily_reps` when loaded and
+    then kept up to date by `add_day_reps`; they are never stored.
+    """
+    
+    __slots__ = ('id', 'exercise', 'total_reps', 'target_days', 'current_reps',
+                 'start_date', 'target_date', 'status', 'first_day', 'daily_reps',
+                 'daily_target', 'completion_date', 'days_active', 'last_active_day',
+                 'streak', 'longest_streak', 'best_day', 'days_on_target')
+    
+    def __init__(self, id: str, exercise: ExerciseType, total_reps: int, target_days: int,
+                 start_date: datetime, target_date: datetime, current_reps: int = 0,
+                 status: ChallengeStatus = ChallengeStatus.ACTIVE,
+                 daily_records: Optional[Dict[str, int]] = None,
+                 daily_target: Optional[float] = None,
+                 completion_date: Optional[datetime] = None):
+        self.id = id
+        self.exercise = exercise
+        self.total_reps = total_reps
+        self.target_days = target_days
+        self.current_reps = current_reps
+        self.start_date = start_date
+        self.target_date = target_date
+        self.status = status
+        self.first_day = start_date.toordinal()
+        self.daily_reps = array('I')
+        for day, reps in (daily_records or {}).items():
+            self.daily_reps[self._offset(date.fromisoformat(day).toordinal())] += reps
+        self.daily_target = daily_target if daily_target is not None else total_reps / target_days
+        self.completion_date = completion_date
+        self.recompute_aggregates()
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Challenge':
+        return cls(
+            id=data['id'],
+            exercise=ExerciseType(data['exercise']),
+            total_reps=data['total_reps'],
+            target_days=data['target_days'],
+            start_date=parse_datetime(data['start_date']),
+            target_date=parse_datetime(data['target_date']),
+            current_reps=data['current_reps'],
+            status=ChallengeStatus(data['status']),
+            daily_records=data.get('daily_records'),
+            daily_target=data.get('daily_target'),
+            completion_date=parse_datetime(data.get('completion_date'))
+        )
+    
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            'id': self.id,
+            'exercise': self.exercise.value,
+            'total_reps': self.total_reps,
+            'target_days': self.target_days,
+            'current_reps': self.current_reps,
+            'start_date': self.start_date.isoformat(),
+            'target_date': self.target_date.isoformat(),
+            'status': self.status.value,
+            'daily_records': self.daily_records,
+            'daily_target': self.daily_target
+        }
+        if self.completion_date is not None:
+            data['completion_date'] = self.completion_date.isoformat()
+        return data
+    
+    @property
+    def daily_records(self) -> Dict[str, int]:
+        """Days with reps as {'YYYY-MM-DD': reps}, the stored format"""
+        first_day = self.first_day
+        return {day_key(first_day + offset): reps
+                for offset, reps in enumerate(self.daily_reps) if reps}
+    
+    def reps_on(self, day: date) -> int:
+        """Reps logged on a given day"""
+        return self.reps_on_ordinal(day.toordinal())
+    
+    def reps_on_ordinal(self, ordinal: int) -> int:
+        offset = ordinal - self.first_day
+        if 0 <= offset < len(self.daily_reps):
+            return self.daily_reps[offset]
+        return 0
+    
+    def _offset(self, ordinal: int) -> int:
+        """Index of a day in `daily_reps`, growing the array to cover it"""
+        offset = ordinal - self.first_day
+        if offset < 0:
+            # Only legacy data has days before the start date; shift the origin back
+            self.daily_reps[0:0] = array('I', [0] * -offset)
+            self.first_day += offset
+            offset = 0
+        if offset >= len(self.daily_reps):
+            self.daily_reps.extend([0] * (offset + 1 - len(self.daily_reps)))
+        return offset
+    
+    def recompute_aggregates(self):
+        """Rebuild streak and per-day aggregates from `daily_reps`"""
+        self.days_active = 0
+        self.last_active_day = 0
+        self.streak = 0
+        self.longest_streak = 0
+        self.best_day = 0
+        self.days_on_target = 0
+        for offset, reps in enumerate(self.daily_reps):
+            if reps:
+                self._count_day(self.first_day + offset, 0, reps)
+    
+    def _count_day(self, ordinal: int, before: int, after: int):
+        """Fold one day's change from `before` to `after` reps into the aggregates"""
+        if not before:
+            self.days_active += 1
+            self.streak = self.streak + 1 if ordinal == self.last_active_day + 1 else 1
+            self.last_active_day = ordinal
+            self.longest_streak = max(self.longest_streak, self.streak)
+        self.best_day = max(self.best_day, after)
+        if before < self.daily_target <= after:
+            self.days_on_target += 1
     
-    def load_data(self) -> Dict[str, Dict[str, Any]]:
-        """Load user data from JSON file"""
+    def add_day_reps(self, day: date, reps: int) -> int:
+        """Add reps to a day and return that day's new total"""
+        ordinal = day.toordinal()
+        offset = self._offset(ordinal)
+        before = self.daily_reps[offset]
+        self.daily_reps[offset] += reps
+        if reps and ordinal >= self.last_active_day:
+            self._count_day(ordinal, before, self.daily_reps[offset])
+        elif reps:
+            # A day before the latest one changed, so the streaks need a full pass
+            self.recompute_aggregates()
+        return self.daily_reps[offset]
+    
+    def current_streak(self, today: date) -> int:
+        """Consecutive active days ending today, or yesterday if today has no reps yet"""
+        if self.last_active_day >= today.toordinal() - 1:
+            return self.streak
+        return 0
+
+class UserRecord:
+    """A user's settings and challenges; kept slotted in memory, stored as a plain dict"""
+    
+    __slots__ = ('challenges', 'timezone', 'reminder_morning', 'reminder_evening',
+                 'reminders_enabled', 'delivery_failures', 'unreachable', 'extra')
+    
+    def __init__(self, challenges: Optional[Dict[str, Challenge]] = None,
+                 timezone: str = 'UTC', reminder_morning: str = '09:00',
+                 reminder_evening: str = '20:00', reminders_enabled: bool = True,
+                 delivery_failures: int = 0, unreachable: bool = False,
+                 extra: Optional[Dict[str, Any]] = None):
+        self.challenges = challenges if challenges is not None else {}
+        # Settings strings repeat across users, share one copy of each
+        self.timezone = sys.intern(timezone)
+        self.reminder_morning = sys.intern(reminder_morning)
+        self.reminder_evening = sys.intern(reminder_evening)
+        self.reminders_enabled = reminders_enabled
+        self.delivery_failures = delivery_failures
+        self.unreachable = unreachable
+        # Unknown stored keys, kept so they survive a round trip
+        self.extra = extra
+    
+    @property
+    def reminder_times(self) -> Dict[str, str]:
+        return {'morning': self.reminder_morning, 'evening': self.reminder_evening}
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'UserRecord':
+        known = ('challenges', 'timezone', 'reminder_times', 'reminders_enabled',
+                 'delivery_failures', 'unreachable')
+        reminder_times = data.get('reminder_times') or {}
+        extra = {key: value for key, value in data.items() if key not in known}
+        return cls(
+            challenges={challenge_id: Challenge.from_dict(challenge)
+                        for challenge_id, challenge in (data.get('challenges') or {}).items()},
+            timezone=data.get('timezone') or 'UTC',
+            reminder_morning=reminder_times.get('morning', '09:00'),
+            reminder_evening=reminder_times.get('evening', '20:00'),
+            reminders_enabled=data.get('reminders_enabled', True),
+            delivery_failures=data.get('delivery_failures', 0),
+            unreachable=data.get('unreachable', False),
+            extra=extra or None
+        )
+    
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            'challenges': {challenge_id: challenge.to_dict()
+                           for challenge_id, challenge in self.challenges.items()},
+            'timezone': self.timezone,
+            'reminder_times': self.reminder_times,
+            'reminders_enabled': self.reminders_enabled
+        }
+        if self.delivery_failures:
+            data['delivery_failures'] = self.delivery_failures
+        if self.unreachable:
+            data['unreachable'] = self.unreachable
+        if self.extra:
+            data.update(self.extra)
+        return data
+    
+    def update(self, changes: Dict[str, Any]):
+        """Apply stored-format field changes (as written in 'settings' records)"""
+        for key, value in changes.items():
+            if key == 'reminder_times':
+                self.reminder_morning = sys.intern(value.get('morning', self.reminder_morning))
+                self.reminder_evening = sys.intern(value.get('evening', self.reminder_evening))
+            elif key in ('timezone', 'reminders_enabled', 'delivery_failures', 'unreachable'):
+                setattr(self, key, sys.intern(value) if isinstance(value, str) else value)
+            else:
+                self.extra = self.extra or {}
+                self.extra[key] = value
+
+SNAPSHOT_MAGIC = b'FCSNAP1'
+
+def json_default(value):
+    """Serialize datetimes as ISO strings"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+class JsonStorage:
+    """Stores all users in a single JSON file, rewritten on every change.
+
+    Snapshots start with a `FCSNAP1 gen=<n> sha256=<hex>` header line, are written
+    to a temp file, fsynced and renamed over DATA_FILE; the previous
+    SNAPSHOT_GENERATIONS files are kept as DATA_FILE.1, DATA_FILE.2, ...
+    """
+
+    # Lazy engines load users on demand instead of returning everything from load()
+    lazy = False
+    # Engines that rewrite the whole file for every batch of changes
+    full_snapshot = True
+    # Stored user fields the reminder index needs
+    REMINDER_KEYS = ('timezone', 'reminder_times', 'reminders_enabled', 'unreachable')
+
+    def __init__(self, data_file: str = DATA_FILE, generations: int = SNAPSHOT_GENERATIONS):
+        self.data_file = data_file
+        self.generations = generations
+        self.generation = 0
+        self._written_generation = 0
+        self._write_lock = threading.Lock()
+        # Single thread writing snapshots handed off by append_many on the event loop;
+        # only the newest snapshot waits for it, older ones are superseded
+        self._writer = None
+        self._newest = None
+        self._handoff = threading.Lock()
+
+    def _snapshot_files(self) -> List[str]:
+        return ([self.data_file, self.data_file + '.tmp']
+                + [f"{self.data_file}.{i}" for i in range(1, self.generations + 1)])
+
+    @staticmethod
+    def _read_snapshot(path: str):
+        """Return (generation, data) for a snapshot file; plain JSON counts as generation 0"""
+        with open(path, 'rb') as f:
+            raw = f.read()
+        if not raw.startswith(SNAPSHOT_MAGIC):
+            return 0, json.loads(raw)
+        header, _, body = raw.partition(b'\n')
+        fields = dict(item.split('=', 1) for item in header.decode().split()[1:])
+        if hashlib.sha256(body).hexdigest() != fields['sha256']:
+            raise ValueError("checksum mismatch")
+        return int(fields['gen']), json.loads(body)
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Load the newest snapshot whose checksum is valid"""
+        best = None
+        for path in self._snapshot_files():
+            if not os.path.exists(path):
+                continue
+            try:
+                generation, data = self._read_snapshot(path)
+            except Exception as e:
+                logger.error(f"Skipping corrupt snapshot {path}: {e}")
+                continue
+            if best is None or generation > best[0]:
+                best = (generation, data, path)
+        if best is None:
+            return {}
+        generation, data, path = best
+        if path != self.data_file:
+            logger.warning(f"Recovered data from {path} (generation {generation})")
+        self.generation = self._written_generation = generation
+        return data
+
+    def serialize(self, user_data: Dict[str, UserRecord]):
+        """Render a snapshot; must run on the thread that mutates user_data"""
+        self.generation += 1
+        data = {user_id: user.to_dict() for user_id, user in user_data.items()}
+        # No indent: indented output bypasses json's C encoder and is several times slower
+        return self.generation, json.dumps(data, default=json_default).encode()
+
+    def write_snapshot(self, generation: int, body: bytes) -> bool:
+        """Write a serialized snapshot crash-safely; safe to call from a worker thread"""
+        with self._write_lock:
+            if generation <= self._written_generation:
+                return True  # a newer snapshot already made it to disk
+            started = time_module.perf_counter()
+            header = f"FCSNAP1 gen={generation} sha256={hashlib.sha256(body).hexdigest()}\n"
+            tmp_file = self.data_file + '.tmp'
+            try:
+                with open(tmp_file, 'wb') as f:
+                    f.write(header.encode())
+                    f.write(body)
+                    f.flush()
+                    os.fsync(f.fileno())
+                for i in range(self.generations - 1, 0, -1):
+                    if os.path.exists(f"{self.data_file}.{i}"):
+                        os.replace(f"{self.data_file}.{i}", f"{self.data_file}.{i + 1}")
+                if self.generations and os.path.exists(self.data_file):
+                    os.replace(self.data_file, f"{self.data_file}.1")
+                os.replace(tmp_file, self.data_file)
+                dir_fd = os.open(os.path.dirname(os.path.abspath(self.data_file)), os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            except Exception as e:
+                logger.error(f"Error saving data: {e}")
+                return False
+            self._written_generation = generation
+            engine = type(self).__name__
+            STORAGE_FLUSH_SECONDS.observe(time_module.perf_counter() - started, engine, 'snapshot')
+            STORAGE_FLUSH_BYTES.inc(len(header) + len(body), engine, 'snapshot')
+            return True
+
+    def save(self, user_data: Dict[str, UserRecord]) -> bool:
+        """Save user data to JSON file"""
+        return self.write_snapshot(*self.serialize(user_data))
+
+    async def save_async(self, user_data: Dict[str, UserRecord]) -> bool:
+        """Serialize on the event loop, then write and fsync in a worker thread"""
+        generation, body = self.serialize(user_data)
+        return await asyncio.to_thread(self.write_snapshot, generation, body)
+
+    def load_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Load a single user (only used by lazy engines)"""
+        return None
+
+    def user_ids(self, active_only: bool = False) -> List[str]:
+        """List stored user ids (only used by lazy engines)"""
+        return []
+
+    def reminder_settings(self) -> Iterator[tuple]:
+        """(user_id, settings) for stored users with an active challenge, where settings
+        holds the REMINDER_KEYS fields only (only used by lazy engines)"""
+        return iter(())
+
+    def pending_user_ids(self) -> set:
+        """Users with changes buffered in memory and not yet handed to the engine"""
+        return set()
+
+    def delete_users(self, user_ids: List[str]):
+        """Remove users (only used by lazy engines; snapshots just leave them out)"""
+
+    def append(self, user_data: Dict[str, UserRecord], record: Dict[str, Any]):
+        """Persist a single change"""
+        self.append_many(user_data, [record])
+
+    def append_many(self, user_data: Dict[str, UserRecord], records: List[Dict[str, Any]]):
+        """Persist a batch of changes; the whole file is rewritten once.
+        
+        On the event loop only the serialization runs inline; writing and fsync
+        go to the writer thread, so handlers do not wait for the disk.
+        """
+        generation, body = self.serialize(user_data)
         try:
-            if os.path.exists(DATA_FILE):
-                with open(DATA_FILE, 'r') as f:
-                    return json.load(f)
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.write_snapshot(generation, body)
+            return
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshot-writer')
+        with self._handoff:
+            idle = self._newest is None
+            self._newest = (generation, body)
+        if idle:
+            self._writer.submit(self._write_newest)
+
+    def _write_newest(self) -> bool:
+        with self._handoff:
+            generation, body = self._newest
+            self._newest = None
+        return self.write_snapshot(generation, body)
+
+    def drain(self):
+        """Wait until snapshots handed to the writer thread are on disk"""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+    async def append_many_async(self, user_data: Dict[str, UserRecord],
+                                records: List[Dict[str, Any]]):
+        """Like append_many, but full snapshots are written off the event loop"""
+        if self.full_snapshot:
+            await self.save_async(user_data)
+        else:
+            self.append_many(user_data, records)
+
+    def close(self, user_data: Dict[str, UserRecord]):
+        """Flush everything before shutdown"""
+        self.drain()
+        self.save(user_data)
+
+class JournalStorage(JsonStorage):
+    """Appends one compact record per change to a journal file.
+
+    The JSON file is only rewritten as a snapshot when the journal is compacted.
+    Records carry absolute totals next to the delta, so replaying a record that is
+    already part of the snapshot is harmless.
+    """
+
+    full_snapshot = False
+
+    def __init__(self, data_file: str = DATA_FILE, journal_file: str = JOURNAL_FILE,
+                 compact_every: int = JOURNAL_COMPACT_EVERY):
+        super().__init__(data_file)
+        self.journal_file = journal_file
+        self.compact_every = compact_every
+        self.pending = 0
+        self._journal = None
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Load the last snapshot and replay the journal on top of it"""
+        user_data = super().load()
+        replayed = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        apply_journal_record(user_data, json.loads(line))
+                        replayed += 1
+                    except Exception as e:
+                        # A torn last line after a crash is expected, skip it
+                        logger.warning(f"Skipping bad journal record: {e}")
+        if replayed:
+            logger.info(f"Replayed {replayed} journal records")
+            self.save({user_id: UserRecord.from_dict(user) for user_id, user in user_data.items()})
+        return user_data
+
+    def save(self, user_data: Dict[str, UserRecord]) -> bool:
+        """Write a snapshot and truncate the journal (compaction)"""
+        if not super().save(user_data):
+            return False
+        if self._journal:
+            self._journal.close()
+        self._journal = open(self.journal_file, 'w')
+        self.pending = 0
+        return True
+
+    def append_many(self, user_data: Dict[str, UserRecord], records: List[Dict[str, Any]]):
+        """Append records to the journal, compacting every `compact_every` records"""
+        try:
+            started = time_module.perf_counter()
+            if self._journal is None:
+                self._journal = open(self.journal_file, 'a')
+            text = ''.join(json.dumps(record, separators=(',', ':'), default=json_default) + '\n'
+                           for record in records)
+            self._journal.write(text)
+            self._journal.flush()
+            STORAGE_FLUSH_SECONDS.observe(time_module.perf_counter() - started, 'JournalStorage', 'journal')
+            STORAGE_FLUSH_BYTES.inc(len(text), 'JournalStorage', 'journal')
         except Exception as e:
-            logger.error(f"Error loading data: {e}")
+            logger.error(f"Error writing journal: {e}")
+            self.save(user_data)
+            return
+        self.pending += len(records)
+        if self.pending >= self.compact_every:
+            self.save(user_data)
+
+    def close(self, user_data: Dict[str, UserRecord]):
+        """Compact and close the journal"""
+        self.save(user_data)
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+class SqliteStorage(JsonStorage):
+    """Keeps users, challenges and daily records in normalized SQLite tables.
+
+    Users are loaded lazily one at a time, and every change is a handful of
+    single-row statements, so cost does not depend on how many users are stored.
+    """
+
+    lazy = True
+    full_snapshot = False
+
+    USER_KEYS = ('challenges', 'timezone', 'reminder_times', 'reminders_enabled')
+    CHALLENGE_COLUMNS = ('id', 'exercise', 'total_reps', 'target_days', 'current_reps',
+                         'start_date', 'target_date', 'status', 'daily_target',
+                         'completion_date')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            timezone TEXT NOT NULL DEFAULT 'UTC',
+            reminder_morning TEXT NOT NULL DEFAULT '09:00',
+            reminder_evening TEXT NOT NULL DEFAULT '20:00',
+            reminders_enabled INTEGER NOT NULL DEFAULT 1,
+            extra TEXT
+        );
+        CREATE TABLE IF NOT EXISTS challenges (
+            user_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            exercise TEXT NOT NULL,
+            total_reps INTEGER NOT NULL,
+            target_days INTEGER NOT NULL,
+            current_reps INTEGER NOT NULL DEFAULT 0,
+            start_date TEXT NOT NULL,
+            target_date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            daily_target REAL NOT NULL,
+            completion_date TEXT,
+            PRIMARY KEY (user_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_challenges_status ON challenges (status, user_id);
+        CREATE TABLE IF NOT EXISTS daily_records (
+            user_id TEXT NOT NULL,
+            challenge_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            reps INTEGER NOT NULL,
+            PRIMARY KEY (user_id, challenge_id, day)
+        );
+    """
+
+    def __init__(self, db_file: str = SQLITE_FILE, data_file: str = DATA_FILE):
+        super().__init__(data_file)
+        self.db_file = db_file
+        self.db = None
+
+    def _connect(self):
+        self.db = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Open the database, importing DATA_FILE the first time; users load lazily"""
+        self._connect()
+        empty = self.db.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+        if empty and os.path.exists(self.data_file):
+            legacy = super().load()
+            if legacy:
+                logger.info(f"Importing {len(legacy)} users from {self.data_file} into SQLite")
+                self.save({user_id: UserRecord.from_dict(user) for user_id, user in legacy.items()})
         return {}
-    
-    def save_data(self):
-        """Save user data to JSON file"""
+
+    def load_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Load one user with their challenges and daily records"""
+        row = self.db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        user = json.loads(row['extra']) if row['extra'] else {}
+        user.update({
+            'challenges': {},
+            'timezone': row['timezone'],
+            'reminder_times': {
+                'morning': row['reminder_morning'],
+                'evening': row['reminder_evening']
+            },
+            'reminders_enabled': bool(row['reminders_enabled'])
+        })
+        for c in self.db.execute("SELECT * FROM challenges WHERE user_id = ?", (user_id,)):
+            challenge = {key: c[key] for key in self.CHALLENGE_COLUMNS}
+            if challenge['completion_date'] is None:
+                del challenge['completion_date']
+            challenge['daily_records'] = {}
+            user['challenges'][challenge['id']] = challenge
+        for r in self.db.execute(
+                "SELECT challenge_id, day, reps FROM daily_records WHERE user_id = ? ORDER BY day",
+                (user_id,)):
+            challenge = user['challenges'].get(r['challenge_id'])
+            if challenge is not None:
+                challenge['daily_records'][r['day']] = r['reps']
+        return user
+
+    def user_ids(self, active_only: bool = False) -> List[str]:
+        """List user ids, optionally only those with an active challenge"""
+        if active_only:
+            rows = self.db.execute(
+                "SELECT DISTINCT user_id FROM challenges WHERE status = ?",
+                (ChallengeStatus.ACTIVE.value,))
+        else:
+            rows = self.db.execute("SELECT user_id FROM users")
+        return [row[0] for row in rows]
+
+    def reminder_settings(self) -> Iterator[tuple]:
+        """Reminder settings from the users table alone; challenges are not read"""
+        rows = self.db.execute(
+            "SELECT user_id, timezone, reminder_morning, reminder_evening, reminders_enabled, "
+            "extra FROM users WHERE user_id IN "
+            "(SELECT user_id FROM challenges WHERE status = ?)",
+            (ChallengeStatus.ACTIVE.value,))
+        for row in rows:
+            extra = json.loads(row['extra']) if row['extra'] else {}
+            yield row['user_id'], {
+                'timezone': row['timezone'],
+                'reminder_times': {'morning': row['reminder_morning'],
+                                   'evening': row['reminder_evening']},
+                'reminders_enabled': bool(row['reminders_enabled']),
+                'unreachable': extra.get('unreachable', False)
+            }
+
+    def _write_user(self, user_id: str, user: Dict[str, Any]):
+        extra = {k: v for k, v in user.items() if k not in self.USER_KEYS}
+        reminder_times = user.get('reminder_times', {})
+        self.db.execute(
+            "INSERT INTO users (user_id, timezone, reminder_morning, reminder_evening, "
+            "reminders_enabled, extra) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET timezone = excluded.timezone, "
+            "reminder_morning = excluded.reminder_morning, "
+            "reminder_evening = excluded.reminder_evening, "
+            "reminders_enabled = excluded.reminders_enabled, extra = excluded.extra",
+            (user_id, user.get('timezone', 'UTC'), reminder_times.get('morning', '09:00'),
+             reminder_times.get('evening', '20:00'), int(user.get('reminders_enabled', True)),
+             json.dumps(extra, default=str) if extra else None))
+
+    def _write_challenge(self, user_id: str, challenge: Dict[str, Any]):
+        self.db.execute(
+            "INSERT OR REPLACE INTO challenges (user_id, id, exercise, total_reps, target_days, "
+            "current_reps, start_date, target_date, status, daily_target, completion_date) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id,) + tuple(map(challenge.get, self.CHALLENGE_COLUMNS)))
+        self.db.executemany(
+            "INSERT OR REPLACE INTO daily_records (user_id, challenge_id, day, reps) "
+            "VALUES (?, ?, ?, ?)",
+            [(user_id, challenge['id'], day, reps)
+             for day, reps in challenge['daily_records'].items()])
+
+    def save(self, user_data: Dict[str, UserRecord]) -> bool:
+        """Write every cached user in one transaction"""
         try:
-            with open(DATA_FILE, 'w') as f:
-                json.dump(self.user_data, f, indent=2, default=str)
+            with self.db:
+                self.db.execute("BEGIN")
+                for user_id, user in user_data.items():
+                    user = user.to_dict()
+                    self._write_user(user_id, user)
+                    for challenge in user['challenges'].values():
+                        self._write_challenge(user_id, challenge)
         except Exception as e:
             logger.error(f"Error saving data: {e}")
+            return False
+        return True
+
+    def append_many(self, user_data: Dict[str, UserRecord], records: List[Dict[str, Any]]):
+        """Apply changes as row-level statements in one transaction"""
+        try:
+            with STORAGE_FLUSH_SECONDS.time('SqliteStorage', 'rows'), self.db:
+                self.db.execute("BEGIN")
+                for record in records:
+                    user_id = record['u']
+                    if record['op'] == 'user':
+                        self._write_user(user_id, record['v'])
+                    elif record['op'] == 'settings':
+                        self._write_user(user_id, user_data[user_id].to_dict())
+                    elif record['op'] == 'challenge':
+                        self._write_challenge(user_id, record['v'])
+                    elif record['op'] == 'reps':
+                        challenge = user_data[user_id].challenges[record['c']]
+                        self.db.execute(
+                            "UPDATE challenges SET current_reps = ?, status = ?, completion_date = ? "
+                            "WHERE user_id = ? AND id = ?",
+                            (record['t'], challenge.status.value,
+                             json_default(challenge.completion_date)
+                             if challenge.completion_date else None,
+                             user_id, record['c']))
+                        self.db.execute(
+                            "INSERT INTO daily_records (user_id, challenge_id, day, reps) "
+                            "VALUES (?, ?, ?, ?) "
+                            "ON CONFLICT (user_id, challenge_id, day) DO UPDATE SET reps = excluded.reps",
+                            (user_id, record['c'], record['ts'][:10], record['dv']))
+        except Exception as e:
+            logger.error(f"Error writing {len(records)} records: {e}")
+
+    def delete_users(self, user_ids: List[str]):
+        """Remove users with their challenges and daily records in one transaction"""
+        with self.db:
+            self.db.execute("BEGIN")
+            for table in ('daily_records', 'challenges', 'users'):
+                self.db.executemany(f"DELETE FROM {table} WHERE user_id = ?",
+                                    [(user_id,) for user_id in user_ids])
+
+    def close(self, user_data: Dict[str, UserRecord]):
+        """Close the database; every change is already committed"""
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+class ShardedStorage(JsonStorage):
+    """Keeps each user in their own JSON file under SHARD_DIR/ab/cd/<user_id>.json.
+
+    Nothing is read at startup; users are loaded on first access. A
+    `<user_id>.active` marker next to the file flags users with an active
+    challenge and holds their reminder settings, so the reminder sweep and index
+    can find them without parsing every user file.
+    """
+
+    lazy = True
+    full_snapshot = False
+
+    def __init__(self, shard_dir: str = SHARD_DIR, data_file: str = DATA_FILE):
+        super().__init__(data_file)
+        self.shard_dir = shard_dir
+
+    def _user_path(self, user_id: str, suffix: str = '.json') -> str:
+        digest = hashlib.sha1(user_id.encode()).hexdigest()
+        return os.path.join(self.shard_dir, digest[:2], digest[2:4], user_id + suffix)
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Create the shard tree, splitting DATA_FILE into it the first time"""
+        if not os.path.isdir(self.shard_dir):
+            os.makedirs(self.shard_dir, exist_ok=True)
+            legacy = super().load()
+            if legacy:
+                logger.info(f"Splitting {len(legacy)} users from {self.data_file} into {self.shard_dir}")
+                self.save({user_id: UserRecord.from_dict(user) for user_id, user in legacy.items()})
+        return {}
+
+    def load_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Read a single user's file"""
+        path = self._user_path(user_id)
+        try:
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading user {user_id}: {e}")
+        return None
+
+    def user_ids(self, active_only: bool = False) -> List[str]:
+        """List user ids by walking the shard tree (file names only)"""
+        suffix = '.active' if active_only else '.json'
+        ids = []
+        for _, _, files in os.walk(self.shard_dir):
+            ids.extend(name[:-len(suffix)] for name in files if name.endswith(suffix))
+        return ids
+
+    def _write_user(self, user_id: str, user: Dict[str, Any]):
+        path = self._user_path(user_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = path + '.tmp'
+        text = json.dumps(user, separators=(',', ':'), default=json_default)
+        with open(tmp_file, 'w') as f:
+            f.write(text)
+        os.replace(tmp_file, path)
+        STORAGE_FLUSH_BYTES.inc(len(text), 'ShardedStorage', 'user_file')
+
+        marker = self._user_path(user_id, '.active')
+        active = any(c['status'] == ChallengeStatus.ACTIVE.value
+                     for c in user['challenges'].values())
+        if active:
+            settings = json.dumps({key: user[key] for key in self.REMINDER_KEYS if key in user},
+                                  separators=(',', ':'))
+            try:
+                with open(marker, 'r') as f:
+                    current = f.read()
+            except FileNotFoundError:
+                current = None
+            if current != settings:
+                with open(marker, 'w') as f:
+                    f.write(settings)
+        elif os.path.exists(marker):
+            os.remove(marker)
+
+    def reminder_settings(self) -> Iterator[tuple]:
+        """Reminder settings from the .active markers; user files are not read"""
+        for directory, _, files in os.walk(self.shard_dir):
+            for name in files:
+                if not name.endswith('.active'):
+                    continue
+                user_id = name[:-len('.active')]
+                try:
+                    with open(os.path.join(directory, name), 'r') as f:
+                        settings = json.loads(f.read() or 'null')
+                except (OSError, ValueError) as e:
+                    logger.error(f"Error reading reminder settings of user {user_id}: {e}")
+                    settings = None
+                if settings is None:
+                    # Empty marker written before settings were kept in it
+                    settings = self.load_user(user_id)
+                if settings is not None:
+                    yield user_id, settings
+
+    def save(self, user_data: Dict[str, UserRecord]) -> bool:
+        """Write every loaded user to their own file"""
+        ok = True
+        for user_id, user in user_data.items():
+            try:
+                self._write_user(user_id, user.to_dict())
+            except Exception as e:
+                logger.error(f"Error saving user {user_id}: {e}")
+                ok = False
+        return ok
+
+    def append_many(self, user_data: Dict[str, UserRecord], records: List[Dict[str, Any]]):
+        """Rewrite only the files of users that changed, once each"""
+        with STORAGE_FLUSH_SECONDS.time('ShardedStorage', 'user_file'):
+            for user_id in dict.fromkeys(record['u'] for record in records):
+                try:
+                    self._write_user(user_id, user_data[user_id].to_dict())
+                except Exception as e:
+                    logger.error(f"Error saving user {user_id}: {e}")
+
+    def delete_users(self, user_ids: List[str]):
+        """Remove users' files and active markers"""
+        for user_id in user_ids:
+            for suffix in ('.json', '.active'):
+                path = self._user_path(user_id, suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def close(self, user_data: Dict[str, UserRecord]):
+        """Every change is written immediately, nothing to flush"""
+
+class WriteBehindStorage:
+    """Buffers changes in memory and lets a background task flush them.
+
+    Handlers only mark the store dirty; bursts of changes within `interval_ms`
+    collapse into one `append_many` call on the wrapped engine.
+    """
+
+    def __init__(self, inner, interval_ms: int = WRITE_BEHIND_MS):
+        self.inner = inner
+        self.lazy = inner.lazy
+        self.interval = interval_ms / 1000
+        self.pending: List[Dict[str, Any]] = []
+        self._user_data = None
+        self._dirty = None
+        self._task = None
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        return self.inner.load()
+
+    def load_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self.inner.load_user(user_id)
+
+    def user_ids(self, active_only: bool = False) -> List[str]:
+        return self.inner.user_ids(active_only)
+
+    def reminder_settings(self) -> Iterator[tuple]:
+        return self.inner.reminder_settings()
+
+    def pending_user_ids(self) -> set:
+        return {record['u'] for record in self.pending}
+
+    def save(self, user_data: Dict[str, UserRecord]) -> bool:
+        """Write everything now, dropping the buffer it supersedes"""
+        self.pending = []
+        return self.inner.save(user_data)
+
+    def append(self, user_data: Dict[str, UserRecord], record: Dict[str, Any]):
+        """Buffer a change; written through immediately if the flusher is not running"""
+        self._user_data = user_data
+        self.pending.append(record)
+        if self._task is None:
+            self.flush()
+        else:
+            self._dirty.set()
+
+    def append_many(self, user_data: Dict[str, UserRecord], records: List[Dict[str, Any]]):
+        for record in records:
+            self.append(user_data, record)
+
+    def flush(self):
+        """Hand all buffered changes to the wrapped engine"""
+        if not self.pending:
+            return
+        records, self.pending = self.pending, []
+        self.inner.append_many(self._user_data, records)
+
+    async def flush_async(self):
+        """Like flush, but lets the engine do its file I/O in a worker thread"""
+        if not self.pending:
+            return
+        records, self.pending = self.pending, []
+        await self.inner.append_many_async(self._user_data, records)
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(self.interval)
+            self._dirty.clear()
+            await self.flush_async()
+
+    def start(self):
+        """Start the background flusher on the running event loop"""
+        if self._task is None:
+            self._dirty = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+    def close(self, user_data: Dict[str, UserRecord]):
+        self.flush()
+        self.inner.close(user_data)
+
+def apply_journal_record(user_data: Dict[str, Dict[str, Any]], record: Dict[str, Any]):
+    """Apply a journal record to user data (idempotent)"""
+    op = record['op']
+    user_id = record['u']
+    if op == 'user':
+        user_data.setdefault(user_id, record['v'])
+        return
+
+    user = user_data.setdefault(user_id, UserRecord().to_dict())
+    if op == 'settings':
+        user.update(record['v'])
+    elif op == 'challenge':
+        user['challenges'][record['c']] = record['v']
+    elif op == 'reps':
+        challenge = user['challenges'][record['c']]
+        challenge['current_reps'] = record['t']
+        challenge['daily_records'][record['ts'][:10]] = record['dv']
+        if (challenge['current_reps'] >= challenge['total_reps']
+                and challenge['status'] != ChallengeStatus.COMPLETED.value):
+            challenge['status'] = ChallengeStatus.COMPLETED.value
+            challenge['completion_date'] = record['ts']
+    else:
+        raise ValueError(f"unknown journal op {op!r}")
+
+def worker_path(path: str, worker: Optional[int] = WORKER_INDEX) -> str:
+    """A data path as owned by one worker; worker 0 (and single-process mode) keep the plain path"""
+    return f"{path}.shard{worker}" if worker else path
+
+def create_storage(worker: Optional[int] = WORKER_INDEX, write_behind: bool = True):
+    """Build the storage engine selected by STORAGE_MODE and WRITE_BEHIND_MS"""
+    data_file = worker_path(DATA_FILE, worker)
+    if STORAGE_MODE == 'journal':
+        storage = JournalStorage(data_file, worker_path(JOURNAL_FILE, worker))
+    elif STORAGE_MODE == 'sqlite':
+        storage = SqliteStorage(worker_path(SQLITE_FILE, worker), data_file)
+    elif STORAGE_MODE == 'sharded':
+        storage = ShardedStorage(worker_path(SHARD_DIR, worker), data_file)
+    else:
+        if STORAGE_MODE != 'json':
+            logger.warning(f"Unknown STORAGE_MODE {STORAGE_MODE!r}, falling back to json")
+        storage = JsonStorage(data_file)
+    if write_behind and WRITE_BEHIND_MS > 0:
+        storage = WriteBehindStorage(storage, WRITE_BEHIND_MS)
+    return storage
+
+class HashRing:
+    """Consistent hash ring assigning user ids to worker indexes.
+    
+    Each worker owns RING_VNODES points on the ring and a user belongs to the
+    first point at or after their hash, so resizing from n to m workers only
+    moves about |m - n| / max(m, n) of the users.
+    """
+    
+    def __init__(self, workers: int, vnodes: int = RING_VNODES):
+        points = sorted((self._hash(f"worker-{worker}-{vnode}"), worker)
+                        for worker in range(workers) for vnode in range(vnodes))
+        self.workers = workers
+        self._hashes = [point for point, _ in points]
+        self._owners = [worker for _, worker in points]
+    
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+    
+    def worker_for(self, user_id) -> int:
+        if self.workers <= 1:
+            return 0
+        i = bisect.bisect_left(self._hashes, self._hash(str(user_id)))
+        return self._owners[i % len(self._owners)]
+
+def load_all_users(storage) -> Dict[str, Dict[str, Any]]:
+    """Every stored user as raw dicts, for lazy and snapshot engines alike"""
+    users = storage.load()
+    if storage.lazy:
+        users = {user_id: storage.load_user(user_id) for user_id in storage.user_ids()}
+    return users
+
+def rebalance_workers(old_count: int, new_count: int) -> int:
+    """Move users whose worker changes between ring sizes; returns how many moved.
+    
+    Users are written to their new worker's files before they are removed from
+    the old ones, so an interrupted rebalance leaves duplicates, never losses.
+    """
+    new_ring = HashRing(new_count)
+    storages = {worker: create_storage(worker, write_behind=False)
+                for worker in range(max(old_count, new_count))}
+    users = {worker: load_all_users(storages[worker]) for worker in range(old_count)}
+    incoming: Dict[int, Dict[str, Dict[str, Any]]] = {}
+    for worker in range(old_count):
+        for user_id, user in users[worker].items():
+            target = new_ring.worker_for(user_id)
+            if target != worker:
+                incoming.setdefault(target, {})[user_id] = user
+    
+    for worker, moved in incoming.items():
+        storage = storages[worker]
+        if worker not in users:
+            users[worker] = load_all_users(storage)
+        if storage.lazy:
+            storage.save({user_id: UserRecord.from_dict(user) for user_id, user in moved.items()})
+            continue
+        users[worker].update(moved)
+        storage.save({user_id: UserRecord.from_dict(user) for user_id, user in users[worker].items()})
+    
+    moved = 0
+    for worker in range(old_count):
+        storage = storages[worker]
+        leaving = [user_id for user_id in users[worker] if new_ring.worker_for(user_id) != worker]
+        moved += len(leaving)
+        if storage.lazy:
+            if leaving:
+                storage.delete_users(leaving)
+            storage.close({})
+        elif leaving:
+            for user_id in leaving:
+                del users[worker][user_id]
+            storage.save({user_id: UserRecord.from_dict(user)
+                          for user_id, user in users[worker].items()})
+    for worker in range(old_count, new_count):
+        if storages[worker].lazy:
+            storages[worker].close({})
+    
+    # Recent deliveries follow their users, so nobody moved today is reminded twice
+    ledgers = {worker: DeliveryLedger(worker_path(REMINDER_LEDGER_FILE, worker))
+               for worker in range(max(old_count, new_count))}
+    for worker in range(old_count):
+        for user_id, slot, day in list(ledgers[worker].delivered):
+            target = new_ring.worker_for(user_id)
+            if target != worker and not ledgers[target].is_delivered(user_id, slot, day):
+                ledgers[target].mark_delivered(user_id, slot, day)
+    for ledger in ledgers.values():
+        ledger.compact()
+    logger.info(f"Rebalanced {old_count} -> {new_count} workers, moved {moved} users")
+    return moved
+
+def read_worker_count() -> int:
+    """Worker count the data files were last split for (1 if never split)"""
+    try:
+        with open(WORKER_STATE_FILE, 'r') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return 1
+
+def split_for_workers(count: int):
+    """Rebalance the data files if they were last split for a different worker count"""
+    previous = read_worker_count()
+    if previous != count:
+        rebalance_workers(previous, count)
+        with open(WORKER_STATE_FILE, 'w') as f:
+            f.write(str(count))
+
+def user_timezone(user: UserRecord):
+    """pytz timezone of a user, UTC if unset or unknown"""
+    try:
+        return pytz.timezone(user.timezone or 'UTC')
+    except pytz.UnknownTimeZoneError:
+        return pytz.utc
+
+class DeliveryLedger:
+    """Durable record of which (user, reminder slot, local date) were delivered.
+
+    One JSON line is appended per delivery, plus markers for the last minute the
+    per-minute job swept and for started/finished global runs. Entries older
+    than yesterday are dropped on load and by `compact`.
+    """
+
+    def __init__(self, ledger_file: str = REMINDER_LEDGER_FILE):
+        self.ledger_file = ledger_file
+        self.delivered: set = set()
+        self.runs: Dict[tuple, str] = {}
+        self.last_minute: Optional[int] = None
+        self._file = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.ledger_file):
+            return
+        with open(self.ledger_file, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                if 'u' in entry:
+                    self.delivered.add((entry['u'], entry['s'], entry['d']))
+                elif 'run' in entry:
+                    self.runs[(entry['run'], entry['d'])] = entry['state']
+                elif 'm' in entry:
+                    self.last_minute = entry['m']
+        self.compact()
+
+    def _write(self, entry: Dict[str, Any]):
+        try:
+            if self._file is None:
+                self._file = open(self.ledger_file, 'a')
+            self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self._file.flush()
+        except Exception as e:
+            logger.error(f"Error writing reminder ledger: {e}")
+
+    def is_delivered(self, user_id: str, slot: str, day: str) -> bool:
+        return (user_id, slot, day) in self.delivered
+
+    def mark_delivered(self, user_id: str, slot: str, day: str):
+        self.delivered.add((user_id, slot, day))
+        self._write({'u': user_id, 's': slot, 'd': day})
+
+    def mark_minute(self, minute: int):
+        """Remember the last minute the per-minute job fully swept"""
+        self.last_minute = minute
+        self._write({'m': minute})
+
+    def mark_run(self, slot: str, day: str, state: str):
+        """Record that a global run was 'started' or is 'done'"""
+        self.runs[(slot, day)] = state
+        self._write({'run': slot, 'd': day, 'state': state})
+
+    def unfinished_runs(self) -> List[tuple]:
+        """(slot, day) of global runs that started but never finished"""
+        return [key for key, state in self.runs.items() if state == 'started']
+
+    def compact(self):
+        """Drop entries older than yesterday and rewrite the ledger file"""
+        oldest = (datetime.now(pytz.utc) - timedelta(days=1)).strftime('%Y-%m-%d')
+        self.delivered = {key for key in self.delivered if key[2] >= oldest}
+        self.runs = {key: state for key, state in self.runs.items() if key[1] >= oldest}
+        if self._file:
+            self._file.close()
+            self._file = None
+        tmp_file = self.ledger_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                for user_id, slot, day in self.delivered:
+                    f.write(json.dumps({'u': user_id, 's': slot, 'd': day}, separators=(',', ':')) + '\n')
+                for (slot, day), state in self.runs.items():
+                    f.write(json.dumps({'run': slot, 'd': day, 'state': state}, separators=(',', ':')) + '\n')
+                if self.last_minute is not None:
+                    f.write(json.dumps({'m': self.last_minute}) + '\n')
+            os.replace(tmp_file, self.ledger_file)
+        except Exception as e:
+            logger.error(f"Error compacting reminder ledger: {e}")
+
+# Fragments of BadRequest messages meaning the chat will never accept messages again
+PERMANENT_BAD_REQUESTS = ('chat not found', 'user is deactivated', 'peer_id_invalid',
+                          'bot was blocked', 'bot was kicked')
+
+def is_permanent_delivery_error(error: Exception) -> bool:
+    """True for send errors that will repeat on every retry (blocked bot, deleted chat)"""
+    if isinstance(error, Forbidden):
+        return True
+    if isinstance(error, BadRequest):
+        message = str(error).lower()
+        return any(fragment in message for fragment in PERMANENT_BAD_REQUESTS)
+    return False
+
+class ReminderIndex:
+    """Buckets (user, reminder slot) pairs by the UTC minute of the day they fire.
+
+    Fire minutes are derived from each user's timezone and reminder_times for a
+    given date, so the index is rebuilt daily to follow DST changes.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[int, Dict[str, set]] = {}
+        self.entries: Dict[str, List[tuple]] = {}
+        self.day = None
+
+    @staticmethod
+    def fire_minute(user: UserRecord, slot: str, day) -> Optional[int]:
+        """UTC minute of the day (0-1439) at which a user's reminder slot fires"""
+        tz = user_timezone(user)
+        try:
+            hour, minute = map(int, user.reminder_times[slot].split(':'))
+        except (KeyError, ValueError):
+            return None
+        local = tz.localize(datetime.combine(day, time(hour=hour, minute=minute)))
+        fire = local.astimezone(pytz.utc)
+        return fire.hour * 60 + fire.minute
+
+    def add_user(self, user_id: str, user: UserRecord):
+        """(Re)index a user after their settings changed"""
+        self.remove_user(user_id)
+        if not user.reminders_enabled or user.unreachable:
+            return
+        day = self.day or datetime.now(pytz.utc).date()
+        entries = []
+        for slot in user.reminder_times:
+            minute = self.fire_minute(user, slot, day)
+            if minute is None:
+                continue
+            self.buckets.setdefault(minute, {}).setdefault(slot, set()).add(user_id)
+            entries.append((minute, slot))
+        if entries:
+            self.entries[user_id] = entries
+
+    def remove_user(self, user_id: str):
+        for minute, slot in self.entries.pop(user_id, []):
+            users = self.buckets[minute][slot]
+            users.discard(user_id)
+            if not users:
+                del self.buckets[minute][slot]
+                if not self.buckets[minute]:
+                    del self.buckets[minute]
+
+    def rebuild(self, users, day=None):
+        """Index every (user_id, user) pair for the given UTC date"""
+        self.buckets = {}
+        self.entries = {}
+        self.day = day or datetime.now(pytz.utc).date()
+        for user_id, user in users:
+            self.add_user(user_id, user)
+
+    def due(self, minute: int) -> List[tuple]:
+        """(user_id, slot) pairs that fire at a UTC minute of the day"""
+        return [(user_id, slot)
+                for slot, users in self.buckets.get(minute, {}).items()
+                for user_id in users]
+
+    def __len__(self):
+        return len(self.entries)
+
+class UserLocks:
+    """One asyncio.Lock per user, created on demand.
+    
+    Locks are only weakly held here, so a user's lock goes away once no handler
+    holds or waits on it.
+    """
+    
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()
+    
+    def __call__(self, user_id: str) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+    
+    def __contains__(self, user_id: str) -> bool:
+        """True while a handler holds or waits on the user's lock"""
+        return user_id in self._locks
+    
+    def __len__(self):
+        return len(self._locks)
+
+class FitnessChallengeBot:
+    """Users, challenges and their indexes.
+    
+    Mutating methods are synchronous and must be called from the event loop
+    thread; storage serializes snapshots there too and only hands finished bytes
+    to worker threads. Handler flows that read state, await, and then write take
+    `user_lock(user_id)` so updates for one user apply one at a time.
+    """
+    
+    def __init__(self, storage=None):
+        self.storage = storage or create_storage()
+        self.user_data = self.load_data()
+        self.user_lock = UserLocks()
+        # Active challenge ids per user (dicts keep creation order) and the set of
+        # users having any, kept in step with create_challenge/add_reps
+        self.active_challenge_ids: Dict[str, Dict[str, None]] = {}
+        self.active_users: set = set()
+        for user_id, user_data in self.user_data.items():
+            self._index_active(user_id, user_data)
+        self.reminder_index = ReminderIndex()
+        self.delivery_ledger = DeliveryLedger(worker_path(REMINDER_LEDGER_FILE))
+        # Cumulative reminder delivery counters; `skipped_unreachable` times the
+        # average failed-send latency estimates the fan-out time saved by pruning
+        self.delivery_stats = {
+            'marked_unreachable': 0,
+            'reachable_again': 0,
+            'skipped_unreachable': 0,
+            'failed_sends': 0,
+            'failed_send_seconds': 0.0,
+        }
+
+    def load_data(self) -> Dict[str, UserRecord]:
+        """Load user data from storage"""
+        return {user_id: UserRecord.from_dict(user)
+                for user_id, user in self.storage.load().items()}
+
+    def save_data(self):
+        """Save all user data to storage"""
+        self.storage.save(self.user_data)
+
+    def close(self):
+        """Flush storage on shutdown"""
+        self.storage.close(self.user_data)
+
+    def _index_active(self, user_id: str, user_data: UserRecord):
+        active = {challenge_id: None
+                  for challenge_id, challenge in user_data.challenges.items()
+                  if challenge.status is ChallengeStatus.ACTIVE}
+        if active:
+            self.active_challenge_ids[user_id] = active
+            self.active_users.add(user_id)
+        else:
+            self.active_challenge_ids.pop(user_id, None)
+            self.active_users.discard(user_id)
     
-    def get_user_data(self, user_id: str) -> Dict[str, Any]:
+    def _load_user(self, user_id: str):
+        """Pull a user into memory from a lazy storage engine"""
+        if not self.storage.lazy:
+            return
+        if user_id in self.user_data:
+            # Recently used users move to the end of user_data; eviction starts at the front
+            self.user_data[user_id] = self.user_data.pop(user_id)
+            return
+        with trace_span('storage'):
+            stored = self.storage.load_user(user_id)
+        if stored is not None:
+            self.user_data[user_id] = UserRecord.from_dict(stored)
+            self._index_active(user_id, self.user_data[user_id])
+            self._evict()
+    
+    def _evict(self):
+        """Drop the least recently used users once lazy engines hold more than LAZY_CACHE_USERS.
+        
+        Evicts down to 90% of the limit so the scan is paid once per many loads.
+        Users with buffered changes or a handler on their lock stay; everyone
+        else is already in storage and is loaded again on their next access.
+        """
+        if not LAZY_CACHE_USERS or len(self.user_data) <= LAZY_CACHE_USERS:
+            return
+        excess = len(self.user_data) - LAZY_CACHE_USERS * 9 // 10
+        pending = self.storage.pending_user_ids()
+        evicted = []
+        for user_id in self.user_data:
+            if len(evicted) >= excess:
+                break
+            if user_id not in pending and user_id not in self.user_lock:
+                evicted.append(user_id)
+        for user_id in evicted:
+            del self.user_data[user_id]
+            self.active_challenge_ids.pop(user_id, None)
+            self.active_users.discard(user_id)
+    
+    def get_user_data(self, user_id: str) -> UserRecord:
         """Get user data, create if doesn't exist"""
+        self._load_user(user_id)
         if user_id not in self.user_data:
-            self.user_data[user_id] = {
-                'challenges': {},
-                'timezone': 'UTC',
-                'reminder_times': {
-                    'morning': '09:00',
-                    'evening': '20:00'
-                },
-                'reminders_enabled': True
-            }
-            self.save_data()
+            self.user_data[user_id] = UserRecord()
+            with trace_span('storage'):
+                self.storage.append(self.user_data, {
+                    'op': 'user', 'u': user_id, 'v': self.user_data[user_id].to_dict(),
+                    'ts': datetime.now().isoformat()
+                })
+            if self.reminder_index.day is not None:
+                self.reminder_index.add_user(user_id, self.user_data[user_id])
+            if self.storage.lazy:
+                self._evict()
         return self.user_data[user_id]
     
+    def find_user(self, user_id: str) -> Optional[UserRecord]:
+        """Get user data if the user exists, without creating it"""
+        self._load_user(user_id)
+        return self.user_data.get(user_id)
+    
+    def has_active_challenges(self, user_id: str) -> bool:
+        """O(1) check whether a user has any active challenge"""
+        self._load_user(user_id)
+        return user_id in self.active_users
+    
+    def update_user_settings(self, user_id: str, **changes):
+        """Change top-level user fields, persist them and reindex reminders"""
+        user_data = self.get_user_data(user_id)
+        user_data.update(changes)
+        with trace_span('storage'):
+            self.storage.append(self.user_data, {
+                'op': 'settings', 'u': user_id, 'v': changes,
+                'ts': datetime.now().isoformat()
+            })
+        if self.reminder_index.day is not None:
+            self.reminder_index.add_user(user_id, user_data)
+    
+    def record_delivery_success(self, user_id: str):
+        """Reset the failure count after a reminder got through"""
+        user_data = self.get_user_data(user_id)
+        if user_data.delivery_failures:
+            self.update_user_settings(user_id, delivery_failures=0)
+    
+    def record_delivery_failure(self, user_id: str, permanent: bool) -> bool:
+        """Count a failed reminder; permanent errors mark the chat unreachable.
+        
+        Returns True if the user was newly marked unreachable.
+        """
+        user_data = self.get_user_data(user_id)
+        failures = user_data.delivery_failures + 1
+        if permanent and not user_data.unreachable:
+            self.update_user_settings(user_id, delivery_failures=failures, unreachable=True)
+            self.delivery_stats['marked_unreachable'] += 1
+            return True
+        self.update_user_settings(user_id, delivery_failures=failures)
+        return False
+    
+    def mark_reachable(self, user_id: str):
+        """Put a user back into the reminder fan-out after they interacted"""
+        user_data = self.find_user(user_id)
+        if user_data and user_data.unreachable:
+            self.update_user_settings(user_id, delivery_failures=0, unreachable=False)
+            self.delivery_stats['reachable_again'] += 1
+    
+    def reminder_user_ids(self) -> List[str]:
+        """User ids that may need a reminder"""
+        if self.storage.lazy:
+            return self.storage.user_ids(active_only=True)
+        return list(self.active_users)
+    
+    def rebuild_reminder_index(self, day=None):
+        """Re-bucket reminder candidates by their UTC fire minute for a date.
+        
+        Users not in memory are indexed from the settings lazy engines keep
+        apart from the records; they are only loaded once they are due.
+        """
+        def candidates():
+            for user_id in self.active_users:
+                yield user_id, self.user_data[user_id]
+            for user_id, settings in self.storage.reminder_settings():
+                if user_id not in self.user_data:
+                    yield user_id, UserRecord.from_dict(settings)
+        
+        self.reminder_index.rebuild(candidates(), day)
+    
     def create_challenge(self, user_id: str, exercise: ExerciseType, total_reps: int, days: int) -> str:
         """Create a new challenge"""
         user_data = self.get_user_data(user_id)
-        challenge_id = f"{exercise.name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-        challenge = {
-            'id': challenge_id,
-            'exercise': exercise.value,
-            'total_reps': total_reps,
-            'target_days': days,
-            'current_reps': 0,
-            'start_date': datetime.now().isoformat(),
-            'target_date': (datetime.now() + timedelta(days=days)).isoformat(),
-            'status': ChallengeStatus.ACTIVE.value,
-            'daily_records': {},
-            'daily_target': total_reps / days
-        }
+        now = datetime.now()
+        challenge_id = f"{exercise.name}_{now.strftime('%Y%m%d_%H%M%S')}"
         
-        user_data['challenges'][challenge_id] = challenge
-        self.save_data()
+        challenge = Challenge(
+            id=challenge_id,
+            exercise=exercise,
+            total_reps=total_reps,
+            target_days=days,
+            start_date=now,
+            target_date=now + timedelta(days=days)
+        )
+        
+        user_data.challenges[challenge_id] = challenge
+        self.active_challenge_ids.setdefault(user_id, {})[challenge_id] = None
+        self.active_users.add(user_id)
+        # The index only holds users that had an active challenge when it was built
+        if self.reminder_index.day is not None and user_id not in self.reminder_index.entries:
+            self.reminder_index.add_user(user_id, user_data)
+        with trace_span('storage'):
+            self.storage.append(self.user_data, {
+                'op': 'challenge', 'u': user_id, 'c': challenge_id, 'v': challenge.to_dict(),
+                'ts': now.isoformat()
+            })
+        CHALLENGES_CREATED.inc()
         return challenge_id
     
     def add_reps(self, user_id: str, challenge_id: str, reps: int):
         """Add reps to a challenge"""
         user_data = self.get_user_data(user_id)
-        if challenge_id not in user_data['challenges']:
+        if challenge_id not in user_data.challenges:
             return False
         
-        challenge = user_data['challenges'][challenge_id]
-        challenge['current_reps'] += reps
+        challenge = user_data.challenges[challenge_id]
+        challenge.current_reps += reps
+        now = datetime.now()
         
         # Track daily records
-        today = datetime.now().strftime('%Y-%m-%d')
-        if today not in challenge['daily_records']:
-            challenge['daily_records'][today] = 0
-        challenge['daily_records'][today] += reps
+        day_total = challenge.add_day_reps(now.date(), reps)
         
         # Check if challenge is completed
-        if challenge['current_reps'] >= challenge['total_reps']:
-            challenge['status'] = ChallengeStatus.COMPLETED.value
-            challenge['completion_date'] = datetime.now().isoformat()
+        if (challenge.current_reps >= challenge.total_reps
+                and challenge.status is ChallengeStatus.ACTIVE):
+            challenge.status = ChallengeStatus.COMPLETED
+            challenge.completion_date = now
+            active = self.active_challenge_ids.get(user_id, {})
+            active.pop(challenge_id, None)
+            if not active:
+                self.active_challenge_ids.pop(user_id, None)
+                self.active_users.discard(user_id)
         
-        self.save_data()
+        with trace_span('storage'):
+            self.storage.append(self.user_data, {
+                'op': 'reps', 'u': user_id, 'c': challenge_id, 'd': reps,
+                't': challenge.current_reps, 'dv': day_total,
+                'ts': now.isoformat()
+            })
+        REPS_LOGGED.inc(reps)
+        REP_ENTRIES.inc()
         return True
     
     def get_challenge_progress(self, user_id: str, challenge_id: str) -> Optional[Dict[str, Any]]:
         """Get challenge progress"""
         user_data = self.get_user_data(user_id)
-        if challenge_id not in user_data['challenges']:
+        if challenge_id not in user_data.challenges:
             return None
         
-        challenge = user_data['challenges'][challenge_id]
-        start_date = datetime.fromisoformat(challenge['start_date'])
-        target_date = datetime.fromisoformat(challenge['target_date'])
-        days_elapsed = (datetime.now() - start_date).days + 1
-        days_remaining = (target_date - datetime.now()).days
+        with trace_span('progress'):
+            return self.compute_progress(user_data.challenges[challenge_id])
+    
+    @staticmethod
+    def compute_progress(challenge: Challenge, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Progress figures for a challenge record"""
+        now = now or datetime.now()
+        days_elapsed = (now - challenge.start_date).days + 1
+        days_remaining = (challenge.target_date - now).days
         
         # Calculate actual daily average
-        actual_daily_avg = challenge['current_reps'] / days_elapsed if days_elapsed > 0 else 0
+        actual_daily_avg = challenge.current_reps / days_elapsed if days_elapsed > 0 else 0
         
         # Calculate needed daily average to finish on time
-        needed_daily_avg = (challenge['total_reps'] - challenge['current_reps']) / max(days_remaining, 1)
+        needed_daily_avg = (challenge.total_reps - challenge.current_reps) / max(days_remaining, 1)
         
         # Calculate projected completion date
         if actual_daily_avg > 0:
-            remaining_reps = challenge['total_reps'] - challenge['current_reps']
+            remaining_reps = challenge.total_reps - challenge.current_reps
             days_to_completion = remaining_reps / actual_daily_avg
-            projected_date = datetime.now() + timedelta(days=days_to_completion)
+            projected_date = now + timedelta(days=days_to_completion)
         else:
             projected_date = None
         
         return {
             'challenge': challenge,
-            'percentage': (challenge['current_reps'] / challenge['total_reps']) * 100,
+            'percentage': (challenge.current_reps / challenge.total_reps) * 100,
             'days_elapsed': days_elapsed,
             'days_remaining': days_remaining,
             'actual_daily_avg': actual_daily_avg,
             'needed_daily_avg': needed_daily_avg,
             'projected_date': projected_date,
-            'on_track': actual_daily_avg >= challenge['daily_target']
+            'on_track': actual_daily_avg >= challenge.daily_target,
+            'days_active': challenge.days_active,
+            'current_streak': challenge.current_streak(now.date()),
+            'longest_streak': challenge.longest_streak,
+            'best_day': challenge.best_day,
+            'days_on_target': challenge.days_on_target
         }
     
     def get_active_challenges(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all active challenges for a user"""
-        user_data = self.get_user_data(user_id)
-        active_challenges = []
+        if not self.has_active_challenges(user_id):
+            return []
+        challenges = self.user_data[user_id].challenges
+        with trace_span('progress'):
+            return [self.compute_progress(challenges[challenge_id])
+                    for challenge_id in self.active_challenge_ids[user_id]]
+
+class BulkProgress:
+    """Reminder progress figures for many challenges at once, held as NumPy columns.
+    
+    Column i holds what the reminder text shows for challenge i: today's reps,
+    the percentage done, the daily average needed to finish on time, the days
+    to completion at the current pace (NaN before any reps) and the on-track
+    flag, computed as in FitnessChallengeBot.compute_progress. Without NumPy
+    the columns are built challenge by challenge.
+    """
+    
+    def __init__(self, challenges: List[Challenge], now: Optional[datetime] = None):
+        self.challenges = challenges
+        self.now = now or datetime.now()
+        if np is None:
+            self._fill_without_numpy()
+            return
         
-        for challenge_id, challenge in user_data['challenges'].items():
-            if challenge['status'] == ChallengeStatus.ACTIVE.value:
-                progress = self.get_challenge_progress(user_id, challenge_id)
-                if progress:
-                    active_challenges.append(progress)
+        count = len(challenges)
+        now = self.now
+        today = now.date().toordinal()
+        current = np.fromiter((c.current_reps for c in challenges), np.float64, count)
+        total = np.fromiter((c.total_reps for c in challenges), np.float64, count)
+        since_start = np.fromiter(((now - c.start_date).total_seconds() for c in challenges),
+                                  np.float64, count)
+        until_target = np.fromiter(((c.target_date - now).total_seconds() for c in challenges),
+                                   np.float64, count)
+        daily_target = np.fromiter((c.daily_target for c in challenges), np.float64, count)
+        self.today_reps = np.fromiter((c.reps_on_ordinal(today) for c in challenges), np.int64, count)
         
-        return active_challenges
+        # timedelta.days floors, so floor-divide seconds by a day
+        days_elapsed = np.floor_divide(since_start, 86400) + 1
+        days_remaining = np.floor_divide(until_target, 86400)
+        remaining_reps = total - current
+        actual_daily_avg = np.divide(current, days_elapsed, out=np.zeros(count),
+                                     where=days_elapsed > 0)
+        self.percentage = current / total * 100
+        self.needed_daily_avg = remaining_reps / np.maximum(days_remaining, 1)
+        self.days_to_completion = np.divide(remaining_reps, actual_daily_avg,
+                                            out=np.full(count, np.nan),
+                                            where=actual_daily_avg > 0)
+        self.on_track = actual_daily_avg >= daily_target
+    
+    def _fill_without_numpy(self):
+        rows = [FitnessChallengeBot.compute_progress(c, self.now) for c in self.challenges]
+        today = self.now.date()
+        self.today_reps = [c.reps_on(today) for c in self.challenges]
+        for key in ('percentage', 'needed_daily_avg', 'on_track'):
+            setattr(self, key, [row[key] for row in rows])
+        self.days_to_completion = [
+            (row['projected_date'] - self.now) / timedelta(days=1)
+            if row['projected_date'] else float('nan') for row in rows
+        ]
+    
+    def __len__(self):
+        return len(self.challenges)
+    
+    def projected_date(self, i: int) -> Optional[datetime]:
+        """When challenge i is done at its current pace, None before any reps"""
+        days = float(self.days_to_completion[i])
+        return self.now + timedelta(days=days) if days == days else None
 
-# Initialize bot instance
-bot_instance = FitnessChallengeBot()
+# Initialize bot instance; the front dispatcher of a multi-process setup holds no users
+SHARD_DISPATCHER = WORKER_COUNT > 1 and WORKER_INDEX is None
+if WORKER_INDEX is None and not SHARD_DISPATCHER:
+    # Back to one process after running with workers: pull in the users of .shard<i> files
+    split_for_workers(1)
+bot_instance = None if SHARD_DISPATCHER else FitnessChallengeBot()
+
+def observed(handler):
+    """Record a handler's latency in HANDLER_SECONDS (only when metrics are served)"""
+    if not METRICS_PORT:
+        return handler
+    
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        with HANDLER_SECONDS.time(handler.__name__):
+            return await handler(update, context)
+    return wrapper
+
+def per_user(handler):
+    """Run a handler under the sending user's lock, one update per user at a time"""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user is None:
+            return await handler(update, context)
+        lock = bot_instance.user_lock(str(update.effective_user.id))
+        with trace_span('lock'):
+            await lock.acquire()
+        try:
+            return await handler(update, context)
+        finally:
+            lock.release()
+    return wrapper
+
+def traced(handler):
+    """Trace each update through a handler and log it if slower than TRACE_SLOW_MS"""
+    if TRACE_SLOW_MS <= 0:
+        return handler
+    
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        trace = UpdateTrace()
+        token = CURRENT_TRACE.set(trace)
+        try:
+            return await handler(update, context)
+        finally:
+            CURRENT_TRACE.reset(token)
+            total = time_module.perf_counter() - trace.started
+            if total * 1000 >= TRACE_SLOW_MS:
+                user = update.effective_user
+                logger.warning(
+                    f"Slow update {update.update_id} ({handler.__name__}, "
+                    f"user {user.id if user else '-'}): {total * 1000:.1f}ms "
+                    f"[{trace.breakdown(total)}]"
+                )
+    return wrapper
 
+@traced
+@observed
+@per_user
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     user = update.effective_user
@@ -263,9 +2080,9 @@ async def handle_my_challenges(update: Update, context: ContextTypes.DEFAULT_TYP
     
     for i, progress in enumerate(active_challenges, 1):
         challenge = progress['challenge']
-        exercise = challenge['exercise']
-        current = challenge['current_reps']
-        total = challenge['total_reps']
+        exercise = challenge.exercise.value
+        current = challenge.current_reps
+        total = challenge.total_reps
         percentage = progress['percentage']
         days_remaining = progress['days_remaining']
         
@@ -275,7 +2092,8 @@ async def handle_my_challenges(update: Update, context: ContextTypes.DEFAULT_TYP
             f"{status_emoji} **{exercise.title()}**\n"
             f"Progress: {current:,}/{total:,} ({percentage:.1f}%)\n"
             f"Days left: {days_remaining}\n"
-            f"Daily avg: {progress['actual_daily_avg']:.1f}\n\n"
+            f"Daily avg: {progress['actual_daily_avg']:.1f}\n"
+            f"Streak: {progress['current_streak']} days\n\n"
         )
     
     await update.message.reply_text(message, parse_mode='Markdown')
@@ -299,8 +2117,8 @@ async def handle_add_reps(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for progress in active_challenges:
         challenge = progress['challenge']
         keyboard.append([InlineKeyboardButton(
-            f"{challenge['exercise'].title()} ({challenge['current_reps']}/{challenge['total_reps']})",
-            callback_data=f"add_reps_{challenge['id']}"
+            f"{challenge.exercise.value.title()} ({challenge.current_reps}/{challenge.total_reps})",
+            callback_data=f"add_reps_{challenge.id}"
         )])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -326,17 +2144,17 @@ async def handle_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     for progress in active_challenges:
         challenge = progress['challenge']
-        exercise = challenge['exercise']
+        exercise = challenge.exercise.value
         
         # Create detailed progress message
         message = f"📊 **{exercise.title()} Challenge Progress**\n\n"
         
         # Basic stats
-        current = challenge['current_reps']
-        total = challenge['total_reps'] 
+        current = challenge.current_reps
+        total = challenge.total_reps
         percentage = progress['percentage']
         
-        message += f"🎯 **Goal**: {total:,} reps in {challenge['target_days']} days\n"
+        message += f"🎯 **Goal**: {total:,} reps in {challenge.target_days} days\n"
         message += f"🔥 **Current**: {current:,} reps ({percentage:.1f}%)\n"
         message += f"📅 **Days elapsed**: {progress['days_elapsed']}\n"
         message += f"⏰ **Days remaining**: {progress['days_remaining']}\n\n"
@@ -349,7 +2167,12 @@ async def handle_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Daily averages and forecasts
         message += f"📈 **Your daily average**: {progress['actual_daily_avg']:.1f} reps\n"
-        message += f"🎯 **Target daily average**: {challenge['daily_target']:.1f} reps\n"
+        message += f"🎯 **Target daily average**: {challenge.daily_target:.1f} reps\n"
+        message += (f"🔥 **Streak**: {progress['current_streak']} days "
+                    f"(longest {progress['longest_streak']})\n")
+        message += f"🏅 **Best day**: {progress['best_day']:,} reps\n"
+        message += (f"✅ **Days on target**: {progress['days_on_target']} "
+                    f"of {progress['days_active']} active days\n")
         
         if progress['days_remaining'] > 0:
             message += f"🚀 **Needed to finish on time**: {progress['needed_daily_avg']:.1f} reps/day\n\n"
@@ -357,14 +2180,15 @@ async def handle_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Forecast
         if progress['projected_date']:
             projected_str = progress['projected_date'].strftime('%B %d, %Y')
-            target_str = datetime.fromisoformat(challenge['target_date']).strftime('%B %d, %Y')
+            target_date = challenge.target_date
+            target_str = target_date.strftime('%B %d, %Y')
             
             if progress['on_track']:
                 message += f"🎉 **Forecast**: You'll finish by {projected_str}!\n"
-                if progress['projected_date'].date() <= datetime.fromisoformat(challenge['target_date']).date():
+                if progress['projected_date'].date() <= target_date.date():
                     message += "✅ You're on track to meet your goal! 🏆"
                 else:
-                    days_late = (progress['projected_date'] - datetime.fromisoformat(challenge['target_date'])).days
+                    days_late = (progress['projected_date'] - target_date).days
                     message += f"⚠️ You'll be {days_late} days late. Consider increasing your daily reps!"
             else:
                 message += f"⚠️ **Warning**: At current pace, you'll finish late!\n"
@@ -409,6 +2233,9 @@ async def handle_exercise_guide(update: Update, context: ContextTypes.DEFAULT_TY
         reply_markup=reply_markup
     )
 
+@traced
+@observed
+@per_user
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle inline keyboard callbacks"""
     query = update.callback_query
@@ -442,7 +2269,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
         
         progress = bot_instance.get_challenge_progress(user_id, challenge_id)
         if progress:
-            exercise = progress['challenge']['exercise']
+            exercise = progress['challenge'].exercise.value
             await query.edit_message_text(
                 f"{username}, how many {exercise} did you complete? 💪\n"
                 f"Enter the number:"
@@ -463,216 +2290,725 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
         
         await query.edit_message_text(guide_message, parse_mode='Markdown')
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle all text messages"""
+async def handle_total_reps_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Challenge creation: the total reps were entered"""
     message_text = update.message.text
     user = update.effective_user
     username = user.first_name or user.username or "User"
-    user_id = str(user.id)
     
-    # Handle menu buttons
-    if message_text == "🆕 New Challenge":
-        await handle_new_challenge(update, context)
-    elif message_text == "📊 My Challenges":
-        await handle_my_challenges(update, context)
-    elif message_text == "➕ Add Reps":
-        await handle_add_reps(update, context)
-    elif message_text == "📈 Progress":
-        await handle_progress(update, context)
-    elif message_text == "⚙️ Settings":
-        await handle_settings(update, context)
-    elif message_text == "📚 Exercise Guide":
-        await handle_exercise_guide(update, context)
-    
-    # Handle challenge creation flow
-    elif context.user_data.get('challenge_step') == 'total_reps':
-        try:
-            total_reps = int(message_text)
-            if total_reps <= 0:
-                await update.message.reply_text(
-                    f"{username}, please enter a positive number! 🤔"
-                )
-                return
-            
-            if total_reps > 100000:
-                await update.message.reply_text(
-                    f"{username}, that's quite ambitious! Please enter a more realistic number (max 100,000). 😅"
-                )
-                return
-            
-            context.user_data['total_reps'] = total_reps
-            context.user_data['challenge_step'] = 'days'
-            
-            exercise = context.user_data['selected_exercise']
+    try:
+        total_reps = int(message_text)
+        if total_reps <= 0:
             await update.message.reply_text(
-                f"Great! {total_reps:,} {exercise.value} it is! 🎯\n\n"
-                f"Now, how many days do you want to complete this challenge?\n"
-                f"Enter number of days (e.g., 30):"
+                f"{username}, please enter a positive number! 🤔"
             )
-            
-        except ValueError:
+            return
+        
+        if total_reps > 100000:
             await update.message.reply_text(
-                f"{username}, please enter a valid number! 🔢"
+                f"{username}, that's quite ambitious! Please enter a more realistic number (max 100,000). 😅"
             )
+            return
+        
+        context.user_data['total_reps'] = total_reps
+        context.user_data['challenge_step'] = 'days'
+        
+        exercise = context.user_data['selected_exercise']
+        await update.message.reply_text(
+            f"Great! {total_reps:,} {exercise.value} it is! 🎯\n\n"
+            f"Now, how many days do you want to complete this challenge?\n"
+            f"Enter number of days (e.g., 30):"
+        )
     
-    elif context.user_data.get('challenge_step') == 'days':
-        try:
-            days = int(message_text)
-            if days <= 0:
-                await update.message.reply_text(
-                    f"{username}, please enter a positive number of days! 📅"
-                )
-                return
-            
-            if days > 365:
-                await update.message.reply_text(
-                    f"{username}, that's over a year! Please choose a shorter timeframe (max 365 days). 📅"
-                )
-                return
-            
-            # Create the challenge
-            exercise = context.user_data['selected_exercise']
-            total_reps = context.user_data['total_reps']
-            
-            challenge_id = bot_instance.create_challenge(user_id, exercise, total_reps, days)
-            
-            daily_target = total_reps / days
-            
-            success_message = (
-                f"🎉 Challenge Created Successfully, {username}!\n\n"
-                f"🏋️‍♂️ **Exercise**: {exercise.value.title()}\n"
-                f"🎯 **Goal**: {total_reps:,} reps in {days} days\n"
-                f"📅 **Daily Target**: {daily_target:.1f} reps/day\n"
-                f"📊 **Start Date**: {datetime.now().strftime('%B %d, %Y')}\n"
-                f"🏁 **Target Finish**: {(datetime.now() + timedelta(days=days)).strftime('%B %d, %Y')}\n\n"
-                f"💪 Your challenge starts now! Use '➕ Add Reps' to log your progress!\n\n"
-                f"🔔 Daily reminders will help keep you on track!"
+    except ValueError:
+        await update.message.reply_text(
+            f"{username}, please enter a valid number! 🔢"
+        )
+
+async def handle_days_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Challenge creation: the number of days was entered, create the challenge"""
+    message_text = update.message.text
+    user = update.effective_user
+    username = user.first_name or user.username or "User"
+    user_id = str(user.id)
+    
+    try:
+        days = int(message_text)
+        if days <= 0:
+            await update.message.reply_text(
+                f"{username}, please enter a positive number of days! 📅"
             )
-            
-            await update.message.reply_text(success_message, parse_mode='Markdown')
-            
-            # Clear challenge creation data
-            context.user_data.clear()
-            
-        except ValueError:
+            return
+        
+        if days > 365:
             await update.message.reply_text(
-                f"{username}, please enter a valid number of days! 📅"
+                f"{username}, that's over a year! Please choose a shorter timeframe (max 365 days). 📅"
             )
+            return
+        
+        # Create the challenge
+        exercise = context.user_data['selected_exercise']
+        total_reps = context.user_data['total_reps']
+        
+        challenge_id = bot_instance.create_challenge(user_id, exercise, total_reps, days)
+        
+        daily_target = total_reps / days
+        
+        success_message = (
+            f"🎉 Challenge Created Successfully, {username}!\n\n"
+            f"🏋️‍♂️ **Exercise**: {exercise.value.title()}\n"
+            f"🎯 **Goal**: {total_reps:,} reps in {days} days\n"
+            f"📅 **Daily Target**: {daily_target:.1f} reps/day\n"
+            f"📊 **Start Date**: {datetime.now().strftime('%B %d, %Y')}\n"
+            f"🏁 **Target Finish**: {(datetime.now() + timedelta(days=days)).strftime('%B %d, %Y')}\n\n"
+            f"💪 Your challenge starts now! Use '➕ Add Reps' to log your progress!\n\n"
+            f"🔔 Daily reminders will help keep you on track!"
+        )
+        
+        await update.message.reply_text(success_message, parse_mode='Markdown')
+        
+        # Clear challenge creation data
+        context.user_data.clear()
     
-    # Handle adding reps
-    elif context.user_data.get('adding_reps'):
-        try:
-            reps = int(message_text)
-            if reps <= 0:
-                await update.message.reply_text(
-                    f"{username}, please enter a positive number! 💪"
-                )
-                return
-            
-            if reps > 10000:
-                await update.message.reply_text(
-                    f"{username}, that seems like a lot! Please enter a realistic number (max 10,000). 😅"
+    except ValueError:
+        await update.message.reply_text(
+            f"{username}, please enter a valid number of days! 📅"
+        )
+
+async def handle_reps_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Log the reps entered for the selected challenge"""
+    message_text = update.message.text
+    user = update.effective_user
+    username = user.first_name or user.username or "User"
+    user_id = str(user.id)
+    
+    try:
+        reps = int(message_text)
+        if reps <= 0:
+            await update.message.reply_text(
+                f"{username}, please enter a positive number! 💪"
+            )
+            return
+        
+        if reps > 10000:
+            await update.message.reply_text(
+                f"{username}, that seems like a lot! Please enter a realistic number (max 10,000). 😅"
+            )
+            return
+        
+        challenge_id = context.user_data['selected_challenge']
+        success = bot_instance.add_reps(user_id, challenge_id, reps)
+        
+        if success:
+            progress = bot_instance.get_challenge_progress(user_id, challenge_id)
+            if progress:
+                challenge = progress['challenge']
+                exercise = challenge.exercise.value
+                
+                success_message = (
+                    f"Excellent work, {username}! 🎉\n\n"
+                    f"✅ **Added**: {reps} {exercise}\n"
+                    f"📊 **Total**: {challenge.current_reps:,}/{challenge.total_reps:,}\n"
+                    f"📈 **Progress**: {progress['percentage']:.1f}%\n"
+                    f"📅 **Daily Average**: {progress['actual_daily_avg']:.1f}\n"
                 )
-                return
-            
-            challenge_id = context.user_data['selected_challenge']
-            success = bot_instance.add_reps(user_id, challenge_id, reps)
-            
-            if success:
-                progress = bot_instance.get_challenge_progress(user_id, challenge_id)
-                if progress:
-                    challenge = progress['challenge']
-                    exercise = challenge['exercise']
-                    
-                    success_message = (
-                        f"Excellent work, {username}! 🎉\n\n"
-                        f"✅ **Added**: {reps} {exercise}\n"
-                        f"📊 **Total**: {challenge['current_reps']:,}/{challenge['total_reps']:,}\n"
-                        f"📈 **Progress**: {progress['percentage']:.1f}%\n"
-                        f"📅 **Daily Average**: {progress['actual_daily_avg']:.1f}\n"
+                
+                if challenge.status is ChallengeStatus.COMPLETED:
+                    success_message += (
+                        f"\n🎉🏆 **CHALLENGE COMPLETED!** 🏆🎉\n"
+                        f"You've successfully completed {challenge.total_reps:,} {exercise}!\n"
+                        f"Amazing dedication and hard work! 💪✨"
                     )
-                    
-                    if challenge['status'] == 'completed':
-                        success_message += (
-                            f"\n🎉🏆 **CHALLENGE COMPLETED!** 🏆🎉\n"
-                            f"You've successfully completed {challenge['total_reps']:,} {exercise}!\n"
-                            f"Amazing dedication and hard work! 💪✨"
-                        )
-                    elif progress['on_track']:
-                        success_message += f"\n🔥 You're on track to meet your goal! Keep it up!"
-                    else:
-                        needed = progress['needed_daily_avg']
-                        success_message += f"\n⚠️ To finish on time, aim for {needed:.1f} reps/day"
-                    
-                    await update.message.reply_text(success_message, parse_mode='Markdown')
-            else:
-                await update.message.reply_text(
-                    f"{username}, there was an error adding your reps. Please try again! 🤔"
-                )
-            
-            context.user_data.clear()
-            
-        except ValueError:
+                elif progress['on_track']:
+                    success_message += f"\n🔥 You're on track to meet your goal! Keep it up!"
+                else:
+                    needed = progress['needed_daily_avg']
+                    success_message += f"\n⚠️ To finish on time, aim for {needed:.1f} reps/day"
+                
+                await update.message.reply_text(success_message, parse_mode='Markdown')
+        else:
             await update.message.reply_text(
-                f"{username}, please enter a valid number! 🔢"
+                f"{username}, there was an error adding your reps. Please try again! 🤔"
             )
+        
+        context.user_data.clear()
     
-    else:
+    except ValueError:
         await update.message.reply_text(
-            f"{username}, please use the menu buttons to navigate! 👇"
+            f"{username}, please enter a valid number! 🔢"
         )
 
-async def send_daily_reminders(context: ContextTypes.DEFAULT_TYPE):
-    """Send daily reminders to users with active challenges"""
-    for user_id, user_data in bot_instance.user_data.items():
-        if not user_data.get('reminders_enabled', True):
+async def handle_unrouted(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Text that is neither a menu button nor an expected answer"""
+    user = update.effective_user
+    username = user.first_name or user.username or "User"
+    await update.message.reply_text(
+        f"{username}, please use the menu buttons to navigate! 👇"
+    )
+
+# Text routing: reply keyboard labels by exact match, then the user's current
+# conversation step; register_menu_route/register_step_route add to them
+MENU_ROUTES: Dict[str, Callable[..., Awaitable[Any]]] = {}
+STEP_ROUTES: Dict[str, Callable[..., Awaitable[Any]]] = {}
+
+def register_menu_route(label: str, handler: Callable[..., Awaitable[Any]]):
+    """Send messages equal to `label` (a keyboard button) to `handler`"""
+    MENU_ROUTES[label] = handler
+
+def register_step_route(step: str, handler: Callable[..., Awaitable[Any]]):
+    """Send free text to `handler` while a user is at conversation `step`"""
+    STEP_ROUTES[step] = handler
+
+def conversation_step(user_data: Dict[str, Any]) -> Optional[str]:
+    """The step a user's free text answers, if any"""
+    if user_data.get('challenge_step'):
+        return user_data['challenge_step']
+    if user_data.get('adding_reps'):
+        return 'adding_reps'
+    return None
+
+def route_message(text: str, user_data: Dict[str, Any]) -> Callable[..., Awaitable[Any]]:
+    """The handler for a text message: its menu button, else the pending step"""
+    handler = MENU_ROUTES.get(text)
+    if handler is None:
+        handler = STEP_ROUTES.get(conversation_step(user_data), handle_unrouted)
+    return handler
+
+def menu_action_timer(handler):
+    """Time a routed handler into MENU_ACTION_SECONDS; a no-op unless metrics are served"""
+    if not METRICS_PORT:
+        return contextlib.nullcontext()
+    return MENU_ACTION_SECONDS.time(handler.__name__)
+
+register_menu_route("🆕 New Challenge", handle_new_challenge)
+register_menu_route("📊 My Challenges", handle_my_challenges)
+register_menu_route("➕ Add Reps", handle_add_reps)
+register_menu_route("📈 Progress", handle_progress)
+register_menu_route("⚙️ Settings", handle_settings)
+register_menu_route("📚 Exercise Guide", handle_exercise_guide)
+register_step_route('total_reps', handle_total_reps_step)
+register_step_route('days', handle_days_step)
+register_step_route('adding_reps', handle_reps_entry)
+
+@traced
+@observed
+@per_user
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle all text messages"""
+    with trace_span('dispatch'):
+        handler = route_message(update.message.text, context.user_data)
+    with menu_action_timer(handler):
+        await handler(update, context)
+
+def build_reminder_texts(user_ids: List[str], now: Optional[datetime] = None) -> Dict[str, str]:
+    """Reminder texts for many users, computing progress in one bulk pass.
+    
+    Users with reminders off or nothing active are left out of the result.
+    """
+    owners = []
+    challenges = []
+    for user_id in user_ids:
+        user_data = bot_instance.get_user_data(user_id)
+        if not user_data.reminders_enabled or not bot_instance.has_active_challenges(user_id):
             continue
+        for challenge_id in bot_instance.active_challenge_ids[user_id]:
+            owners.append(user_id)
+            challenges.append(user_data.challenges[challenge_id])
+    
+    bulk = BulkProgress(challenges, now)
+    lines: Dict[str, List[str]] = {}
+    for i, challenge in enumerate(challenges):
+        exercise = challenge.exercise.value
+        daily_target = challenge.daily_target
         
-        active_challenges = bot_instance.get_active_challenges(user_id)
-        if not active_challenges:
-            continue
+        # Check if user has done reps today
+        today_reps = bulk.today_reps[i]
+        
+        if today_reps == 0:
+            line = f"🎯 {exercise.title()}: {daily_target:.0f} reps needed\n"
+            streak = challenge.current_streak(bulk.now.date())
+            if streak > 1:
+                line += f"   Keep your {streak}-day streak alive! 🔥\n"
+        elif today_reps < daily_target:
+            remaining = daily_target - today_reps
+            line = f"🔥 {exercise.title()}: {remaining:.0f} more reps to reach daily goal\n"
+        else:
+            line = f"✅ {exercise.title()}: Daily goal achieved! 🎉\n"
+        
+        # Where the challenge as a whole stands
+        projected = bulk.projected_date(i)
+        line += f"   📊 {bulk.percentage[i]:.0f}% done, "
+        if bulk.on_track[i] and projected:
+            line += f"on track to finish by {projected.strftime('%B %d')}\n"
+        else:
+            line += f"{bulk.needed_daily_avg[i]:.0f} reps/day needed to finish on time\n"
+        lines.setdefault(owners[i], []).append(line)
+    
+    return {
+        user_id: (
+            "🔔 **Daily Fitness Reminder!**\n\n"
+            "💪 Time to work on your challenges:\n\n"
+            + ''.join(user_lines)
+            + "\n💪 You've got this! Every rep counts! 🏆"
+        )
+        for user_id, user_lines in lines.items()
+    }
+
+def build_reminder_text(user_id: str) -> Optional[str]:
+    """Reminder text for a user, or None if there is nothing to remind about"""
+    return build_reminder_texts([user_id]).get(user_id)
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`"""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time_module.monotonic()
+        self.blocked_until = 0.0
+    
+    def pause(self, seconds: float):
+        """Hand out no tokens for the next `seconds` (flood control)"""
+        self.blocked_until = max(self.blocked_until, time_module.monotonic() + seconds)
+        self.tokens = 0
+    
+    async def acquire(self):
+        while True:
+            now = time_module.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ReminderFanOut:
+    """Sends reminders with a bounded pool of workers under Telegram's rate limits.
+
+    A shared token bucket caps bot-wide throughput, a per-chat bucket caps each
+    chat, RetryAfter pauses the shared bucket for the requested time, and
+    timeouts/network errors are retried with exponential backoff.
+    """
+    
+    def __init__(self, bot, ledger: Optional[DeliveryLedger] = None,
+                 workers: int = REMINDER_WORKERS,
+                 global_rate: float = REMINDER_PROCESS_RATE,
+                 chat_rate: float = REMINDER_CHAT_RATE,
+                 max_retries: int = REMINDER_MAX_RETRIES,
+                 batch_size: int = REMINDER_BATCH_SIZE):
+        self.bot = bot
+        self.ledger = ledger
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.report = {'sent': 0, 'failed': 0, 'throttled': 0, 'retried': 0, 'skipped': 0,
+                       'already_sent': 0, 'unreachable': 0, 'pruned': 0}
+    
+    async def _send(self, chat_id: int, text: str):
+        for attempt in range(self.max_retries + 1):
+            chat_bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, 1))
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode='Markdown')
+                return
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self.report['throttled'] += 1
+                self.global_bucket.pause(retry_after)
+                if attempt == self.max_retries:
+                    raise
+            except BadRequest:
+                raise  # a NetworkError subclass, but retrying will not help
+            except (TimedOut, NetworkError):
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** attempt)
+            self.report['retried'] += 1
+    
+    async def _enqueue(self, queue: asyncio.Queue, batch: List[tuple]):
+        """Drop unreachable and already reminded users, then build texts for the rest in bulk"""
+        stats = bot_instance.delivery_stats
+        pending = []
+        for user_id, slot in batch:
+            user_data = bot_instance.get_user_data(user_id)
+            if user_data.unreachable:
+                self.report['unreachable'] += 1
+                stats['skipped_unreachable'] += 1
+                continue
+            # Deliveries are keyed by the user's local date
+            day = datetime.now(user_timezone(user_data)).strftime('%Y-%m-%d')
+            if self.ledger and self.ledger.is_delivered(user_id, slot, day):
+                self.report['already_sent'] += 1
+                continue
+            pending.append((user_id, slot, day))
         
-        # Get user info (this would need to be stored or retrieved differently in production)
         try:
-            user_id_int = int(user_id)
-            
-            reminder_text = "🔔 **Daily Fitness Reminder!**\n\n"
-            reminder_text += "💪 Time to work on your challenges:\n\n"
-            
-            for progress in active_challenges:
-                challenge = progress['challenge']
-                exercise = challenge['exercise']
-                daily_target = challenge['daily_target']
-                
-                # Check if user has done reps today
-                today = datetime.now().strftime('%Y-%m-%d')
-                today_reps = challenge['daily_records'].get(today, 0)
-                
-                if today_reps == 0:
-                    reminder_text += f"🎯 {exercise.title()}: {daily_target:.0f} reps needed\n"
-                elif today_reps < daily_target:
-                    remaining = daily_target - today_reps
-                    reminder_text += f"🔥 {exercise.title()}: {remaining:.0f} more reps to reach daily goal\n"
-                else:
-                    reminder_text += f"✅ {exercise.title()}: Daily goal achieved! 🎉\n"
-            
-            reminder_text += "\n💪 You've got this! Every rep counts! 🏆"
-            
-            await context.bot.send_message(
-                chat_id=user_id_int,
-                text=reminder_text,
-                parse_mode='Markdown'
-            )
-            
+            texts = build_reminder_texts([user_id for user_id, _, _ in pending])
         except Exception as e:
-            logger.error(f"Error sending reminder to user {user_id}: {e}")
+            self.report['failed'] += len(pending)
+            logger.error(f"Error building reminders for {len(pending)} users: {e}")
+            return
+        for user_id, slot, day in pending:
+            if user_id not in texts:
+                self.report['skipped'] += 1
+                continue
+            await queue.put((user_id, slot, day, texts[user_id]))
+    
+    async def _worker(self, queue: asyncio.Queue):
+        stats = bot_instance.delivery_stats
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            user_id, slot, day, reminder_text = item
+            sending_since = time_module.monotonic()
+            try:
+                await self._send(int(user_id), reminder_text)
+                self.report['sent'] += 1
+                if self.ledger:
+                    self.ledger.mark_delivered(user_id, slot, day)
+                bot_instance.record_delivery_success(user_id)
+            except Exception as e:
+                self.report['failed'] += 1
+                stats['failed_sends'] += 1
+                stats['failed_send_seconds'] += time_module.monotonic() - sending_since
+                if bot_instance.record_delivery_failure(user_id, is_permanent_delivery_error(e)):
+                    self.report['pruned'] += 1
+                    logger.info(f"User {user_id} is unreachable ({e}), pausing their reminders")
+                else:
+                    logger.error(f"Error sending reminder to user {user_id}: {e}")
+    
+    async def run(self, targets) -> Dict[str, Any]:
+        """Remind every (user_id, slot) in `targets` and return a summary of the run"""
+        started = time_module.monotonic()
+        queue = asyncio.Queue(maxsize=2 * self.batch_size)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        total = 0
+        batch = []
+        for target in targets:
+            total += 1
+            batch.append(target)
+            if len(batch) >= self.batch_size:
+                await self._enqueue(queue, batch)
+                batch = []
+        if batch:
+            await self._enqueue(queue, batch)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        
+        duration = time_module.monotonic() - started
+        self.report['total'] = total
+        self.report['duration'] = duration
+        self.report['per_second'] = self.report['sent'] / duration if duration > 0 else 0.0
+        return self.report
+
+async def send_reminders(context: ContextTypes.DEFAULT_TYPE, targets, kind: str = 'due') -> Dict[str, Any]:
+    """Send reminders to the given (user_id, slot) pairs and log a summary"""
+    report = await ReminderFanOut(context.bot, bot_instance.delivery_ledger).run(targets)
+    REMINDER_RUN_SECONDS.observe(report['duration'], kind)
+    REMINDER_THROUGHPUT.set(report['per_second'], kind)
+    for outcome in ('sent', 'failed', 'skipped', 'already_sent', 'unreachable'):
+        if report[outcome]:
+            REMINDERS.inc(report[outcome], outcome)
+    if report['total']:
+        logger.info(
+            f"Reminder run: {report['sent']} sent, {report['failed']} failed, "
+            f"{report['throttled']} throttled, {report['skipped']} skipped, "
+            f"{report['already_sent']} already sent, "
+            f"{report['unreachable']} unreachable ({report['pruned']} newly) "
+            f"of {report['total']} in {report['duration']:.1f}s "
+            f"({report['per_second']:.1f} msg/s)"
+        )
+    stats = bot_instance.delivery_stats
+    if report['unreachable'] and stats['failed_sends']:
+        average_failure = stats['failed_send_seconds'] / stats['failed_sends']
+        logger.info(
+            f"Skipping unreachable chats saved ~{report['unreachable'] * average_failure:.1f}s "
+            f"this run ({stats['skipped_unreachable']} skips so far)"
+        )
+    return report
+
+async def send_daily_reminders(context: ContextTypes.DEFAULT_TYPE):
+    """Send daily reminders to users with active challenges"""
+    job = getattr(context, 'job', None)
+    slot = job.data.get('slot', 'daily') if job and job.data else 'daily'
+    day = datetime.now().strftime('%Y-%m-%d')
+    ledger = bot_instance.delivery_ledger
+    ledger.mark_run(slot, day, 'started')
+    report = await send_reminders(
+        context, [(user_id, slot) for user_id in bot_instance.reminder_user_ids()], kind=slot
+    )
+    ledger.mark_run(slot, day, 'done')
+    return report
+
+async def send_due_reminders(context: ContextTypes.DEFAULT_TYPE):
+    """Per-minute job: remind only the users whose local reminder time is now"""
+    ledger = bot_instance.delivery_ledger
+    now_minute = int(datetime.now(pytz.utc).timestamp() // 60)
+    # Resume from the last swept minute, also across restarts
+    last_minute = ledger.last_minute
+    if last_minute is None or now_minute - last_minute > REMINDER_CATCHUP_MINUTES:
+        last_minute = now_minute - 1
+    
+    for minute in range(last_minute + 1, now_minute + 1):
+        due = [(user_id, slot) for user_id, slot in bot_instance.reminder_index.due(minute % (24 * 60))
+               if bot_instance.has_active_challenges(user_id)]
+        if due:
+            await send_reminders(context, due)
+        ledger.mark_minute(minute)
+
+async def rebuild_reminder_index(context: ContextTypes.DEFAULT_TYPE):
+    """Daily job: recompute fire minutes so DST changes are picked up"""
+    bot_instance.rebuild_reminder_index()
+    bot_instance.delivery_ledger.compact()
+    logger.info(f"Reminder index rebuilt for {len(bot_instance.reminder_index)} users")
+
+async def track_interaction(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Any update from a user proves their chat is reachable again"""
+    if update.callback_query:
+        UPDATES.inc(1, 'callback_query')
+    elif update.message and update.message.text and update.message.text.startswith('/'):
+        UPDATES.inc(1, 'command')
+    elif update.message:
+        UPDATES.inc(1, 'message')
+    else:
+        UPDATES.inc(1, 'other')
+    if update.effective_user:
+        bot_instance.mark_reachable(str(update.effective_user.id))
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates from different chats concurrently, each chat's in order.
+    
+    An update for a chat that is already being processed is queued behind it and
+    run by the task handling that chat, so a burst from one chat takes up a single
+    concurrency slot instead of parking several.
+    """
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._backlogs: Dict[Any, deque] = {}
+    
+    @staticmethod
+    def chat_key(update: object):
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+    
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self.chat_key(update)
+        if key is None:
+            await coroutine
+            return
+        if key in self._backlogs:
+            self._backlogs[key].append(coroutine)
+            return
+        
+        backlog = self._backlogs[key] = deque([coroutine])
+        try:
+            while backlog:
+                try:
+                    await backlog.popleft()
+                except Exception as e:
+                    logger.error(f"Error processing update for chat {key}: {e}")
+        finally:
+            del self._backlogs[key]
+            for pending in backlog:
+                pending.close()
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
+
+async def post_init(application: Application):
+    """Start background storage tasks once the event loop is running"""
+    if isinstance(bot_instance.storage, WriteBehindStorage):
+        bot_instance.storage.start()
+    if METRICS_PORT:
+        port = METRICS_PORT + (WORKER_INDEX or 0)
+        application.bot_data['metrics_server'] = await asyncio.start_server(
+            serve_metrics, METRICS_LISTEN, port)
+        logger.info(f"Serving metrics on http://{METRICS_LISTEN}:{port}/metrics")
+    if REMINDER_SCHEDULE == 'timezone':
+        bot_instance.rebuild_reminder_index()
+    else:
+        # Resume global runs that were cut off by a restart
+        for slot, day in bot_instance.delivery_ledger.unfinished_runs():
+            if day == datetime.now().strftime('%Y-%m-%d'):
+                logger.info(f"Resuming interrupted {slot} reminder run")
+                application.job_queue.run_once(send_daily_reminders, 0, data={'slot': slot})
+
+async def post_shutdown(application: Application):
+    """Flush buffered changes on shutdown (also reached on SIGTERM)"""
+    if isinstance(bot_instance.storage, WriteBehindStorage):
+        await bot_instance.storage.stop()
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server is not None:
+        metrics_server.close()
+
+class ServeOnlyBot(ExtBot):
+    """A bot that never registers a webhook itself.
+    
+    run_webhook always calls setWebhook, with a URL guessed from the listen
+    address when none is given; processes serving a webhook registered by
+    someone else (extra workers behind a load balancer, dispatcher-fed workers)
+    use this bot so they leave the registration alone.
+    """
+    
+    async def set_webhook(self, *args, **kwargs) -> bool:
+        return True
+
+def spawn_worker(index: int, secret: str) -> subprocess.Popen:
+    env = dict(os.environ, WORKER_INDEX=str(index), WORKER_SECRET=secret)
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+class WorkerPool:
+    """Worker processes of the front dispatcher, each fed from its own queue.
+    
+    Every worker has a forwarding task that POSTs its updates in order and
+    retries until each is taken. A worker found dead on a failed attempt is
+    restarted right there, and since the queues are independent, updates for
+    the other workers keep flowing meanwhile.
+    """
+    
+    def __init__(self, count: int, secret: str):
+        self.secret = secret
+        self.ring = HashRing(count)
+        self.processes = [spawn_worker(i, secret) for i in range(count)]
+        self.queues: List[asyncio.Queue] = [asyncio.Queue() for _ in range(count)]
+    
+    def ensure_running(self, worker: int) -> bool:
+        """Restart a worker that exited; returns True if it had to be restarted"""
+        process = self.processes[worker]
+        if process.poll() is None:
+            return False
+        logger.error(f"Worker {worker} exited with {process.returncode}, restarting it")
+        self.processes[worker] = spawn_worker(worker, self.secret)
+        return True
+    
+    def dispatch(self, updates: List[Update]):
+        """Queue updates for the workers owning their users"""
+        for update in updates:
+            user = update.effective_user
+            self.queues[self.ring.worker_for(user.id if user else 0)].put_nowait(update)
+    
+    async def forward(self, client: httpx.AsyncClient, worker: int):
+        """POST a worker's queued updates to it, one at a time, for as long as the pool runs"""
+        url = f"http://127.0.0.1:{WORKER_BASE_PORT + worker}/{WEBHOOK_PATH}"
+        headers = {'Content-Type': 'application/json',
+                   'X-Telegram-Bot-Api-Secret-Token': self.secret}
+        queue = self.queues[worker]
+        while True:
+            update = await queue.get()
+            delay = 0.5
+            while True:
+                try:
+                    response = await client.post(url, content=update.to_json(), headers=headers)
+                    if response.status_code < 500:
+                        if response.status_code != 200:
+                            logger.error(f"Worker {worker} rejected update {update.update_id}: "
+                                         f"HTTP {response.status_code}")
+                        break
+                    logger.warning(f"Worker {worker} failed update {update.update_id}: "
+                                   f"HTTP {response.status_code}")
+                except httpx.HTTPError as e:
+                    logger.warning(f"Worker {worker} unreachable ({e!r}), retrying")
+                # A dead worker never answers; start a new one and retry against it
+                if self.ensure_running(worker):
+                    delay = 0.5
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+    
+    def stop(self):
+        """Terminate the workers; updates still queued are lost"""
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+        unsent = sum(queue.qsize() for queue in self.queues)
+        if unsent:
+            logger.warning(f"{unsent} updates were not forwarded before shutdown")
+
+async def run_dispatcher():
+    """Front process: split the data for WORKER_COUNT workers, start them and feed them updates.
+    
+    An update is confirmed to Telegram once it is queued for its worker, so a
+    worker that is down does not stop polling for everyone else.
+    """
+    split_for_workers(WORKER_COUNT)
+    pool = WorkerPool(WORKER_COUNT, WORKER_SECRET or secrets.token_urlsafe(24))
+    logger.info(f"Dispatching updates to {WORKER_COUNT} workers")
+    try:
+        async with Bot(BOT_TOKEN, base_url=BOT_API_URL) as bot, httpx.AsyncClient(timeout=10) as client:
+            await bot.delete_webhook()
+            forwarders = [asyncio.create_task(pool.forward(client, i)) for i in range(WORKER_COUNT)]
+            try:
+                offset = None
+                while True:
+                    # Also catches workers that died while they had nothing to forward
+                    for i in range(WORKER_COUNT):
+                        pool.ensure_running(i)
+                    try:
+                        updates = await bot.get_updates(offset=offset, timeout=30,
+                                                        allowed_updates=Update.ALL_TYPES)
+                    except (TimedOut, NetworkError) as e:
+                        logger.warning(f"Polling failed: {e}")
+                        await asyncio.sleep(1)
+                        continue
+                    if updates:
+                        pool.dispatch(updates)
+                        offset = updates[-1].update_id + 1
+            finally:
+                for task in forwarders:
+                    task.cancel()
+    finally:
+        pool.stop()
 
 def main():
     """Start the bot"""
+    if SHARD_DISPATCHER:
+        # Stop (and take the workers down) on SIGTERM as on Ctrl+C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            asyncio.run(run_dispatcher())
+        except KeyboardInterrupt:
+            pass
+        return
+    
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = Application.builder()
+    # Bot API calls made while handling updates show up in their traces
+    request_class = TracedRequest if TRACE_SLOW_MS > 0 else HTTPXRequest
+    if WORKER_INDEX is not None or (UPDATE_MODE == 'webhook' and not WEBHOOK_URL):
+        builder.bot(ServeOnlyBot(BOT_TOKEN, base_url=BOT_API_URL,
+                                 request=request_class(connection_pool_size=256),
+                                 get_updates_request=HTTPXRequest()))
+    else:
+        builder.token(BOT_TOKEN).base_url(BOT_API_URL)
+        if TRACE_SLOW_MS > 0:
+            builder.request(TracedRequest(connection_pool_size=256))
+    builder.post_init(post_init).post_shutdown(post_shutdown)
+    if CONCURRENT_UPDATES > 1:
+        builder.concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+    application = builder.build()
     
     # Add handlers
+    application.add_handler(TypeHandler(Update, track_interaction), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CallbackQueryHandler(handle_callback_query))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
@@ -680,24 +3016,71 @@ def main():
     # Add job queue for reminders
     job_queue = application.job_queue
     
-    # Schedule morning reminders (9:00 AM daily)
-    job_queue.run_daily(
-        send_daily_reminders,
-        time=time(hour=9, minute=0),
-        name="morning_reminder"
-    )
-    
-    # Schedule evening reminders (8:00 PM daily) 
-    job_queue.run_daily(
-        send_daily_reminders,
-        time=time(hour=20, minute=0),
-        name="evening_reminder"
-    )
+    if REMINDER_SCHEDULE == 'timezone':
+        # Fire every minute, on the minute, for the users due in that minute
+        now = datetime.now(pytz.utc)
+        job_queue.run_repeating(
+            send_due_reminders,
+            interval=60,
+            first=60 - now.second - now.microsecond / 1_000_000,
+            name="due_reminders"
+        )
+        
+        # Re-bucket users at UTC midnight so DST shifts are followed
+        job_queue.run_daily(
+            rebuild_reminder_index,
+            time=time(hour=0, minute=0, tzinfo=pytz.utc),
+            name="reminder_index"
+        )
+    else:
+        # Schedule morning reminders (9:00 AM daily)
+        job_queue.run_daily(
+            send_daily_reminders,
+            time=time(hour=9, minute=0),
+            data={'slot': 'morning'},
+            name="morning_reminder"
+        )
+        
+        # Schedule evening reminders (8:00 PM daily) 
+        job_queue.run_daily(
+            send_daily_reminders,
+            time=time(hour=20, minute=0),
+            data={'slot': 'evening'},
+            name="evening_reminder"
+        )
     
     # Start the bot
     print("🤖 Advanced Fitness Challenge Bot is starting...")
     print("💪 Ready to help users achieve their fitness goals!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WORKER_INDEX is not None:
+        # Updates come from the dispatcher, never from Telegram directly
+        application.run_webhook(
+            listen='127.0.0.1',
+            port=WORKER_BASE_PORT + WORKER_INDEX,
+            url_path=WEBHOOK_PATH,
+            secret_token=WORKER_SECRET or None,
+            allowed_updates=Update.ALL_TYPES
+        )
+    elif UPDATE_MODE == 'webhook':
+        secret = WEBHOOK_SECRET
+        if not secret and WEBHOOK_URL:
+            # Registered with the webhook below, so Telegram sends it back with every update
+            secret = secrets.token_urlsafe(24)
+            logger.warning("WEBHOOK_SECRET is not set; registering the webhook with a generated "
+                           "secret (set WEBHOOK_SECRET when several processes share the webhook)")
+        elif not secret:
+            logger.warning("WEBHOOK_SECRET is not set; webhook requests are not authenticated")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            secret_token=secret,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}" if WEBHOOK_URL else None,
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    bot_instance.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
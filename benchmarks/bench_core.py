@@ -0,0 +1,155 @@
+"""Microbenchmarks of FitnessChallengeBot's core operations by population size.
+
+Usage: python benchmarks/bench_core.py [--sizes 1000,100000,1000000] [--storage json]
+           [--challenges 2] [--days 30] [--calls 1000] [--budget 10] [--sync] [--json]
+
+For every size a data file of users with `--days` of daily_records per
+challenge is written to a scratch directory and loaded by the bot with the
+chosen STORAGE_MODE (write-behind off, as in the default deployment).
+create_challenge and add_reps run inside an event loop, as the handlers call
+them, so they time what holds up the loop: with json storage that is the
+serialization, while the write and fsync go to the snapshot-writer thread.
+`--sync` runs them outside a loop instead, where every change is written
+before the call returns. Each operation then runs on
+randomly picked users until `--calls` calls or `--budget` seconds, whichever
+comes first, so an operation that rewrites the whole data file still finishes
+at a million users. get_user_data runs first, on users nothing has touched yet
+(for lazy engines that includes reading the user from storage).
+
+--json prints every size with per-operation call counts, mean, p50 and p99 for
+regression tracking.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import tempfile
+import time
+
+from common import load_bot_module, write_stored_users
+
+OPERATIONS = ('load_data', 'save_data', 'get_user_data', 'create_challenge', 'add_reps',
+              'get_challenge_progress', 'get_active_challenges')
+
+
+def measure(call, arguments, budget):
+    """Per-call seconds of `call(*args)` over `arguments`, stopping once over budget"""
+    timings = []
+    deadline = time.perf_counter() + budget
+    for args in arguments:
+        started = time.perf_counter()
+        call(*args)
+        finished = time.perf_counter()
+        timings.append(finished - started)
+        if finished > deadline:
+            break
+    return timings
+
+
+def measure_on_loop(call, arguments, budget):
+    """measure() from inside a running event loop"""
+    async def run():
+        return measure(call, arguments, budget)
+    return asyncio.run(run())
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    return {
+        'calls': len(ordered),
+        'mean_us': sum(ordered) / len(ordered) * 1e6,
+        'p50_us': ordered[len(ordered) // 2] * 1e6,
+        'p99_us': ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))] * 1e6,
+        'total_s': sum(ordered),
+    }
+
+
+def run_size(users, args):
+    workdir = tempfile.mkdtemp(prefix='fitness-bench-')
+    started = time.perf_counter()
+    write_stored_users(os.path.join(workdir, 'data.json'), users, args.challenges, args.days)
+    generated = time.perf_counter() - started
+
+    # Importing the module builds bot_instance, which loads (or imports) the data file
+    started = time.perf_counter()
+    bot = load_bot_module(workdir, STORAGE_MODE=args.storage, WRITE_BEHIND_MS=0)
+    startup = time.perf_counter() - started
+    instance = bot.bot_instance
+
+    rng = random.Random(users)
+    sample = [str(100000000 + i) for i in rng.sample(range(users), min(users, args.calls))]
+    repeat = [()] * args.calls
+    timings = {}
+
+    # The loaded copy is dropped straight away; lazy engines return nothing here
+    timings['load_data'] = measure(lambda: instance.load_data().clear(), repeat, args.budget)
+    gc.collect()
+
+    timings['get_user_data'] = measure(instance.get_user_data, [(u,) for u in sample], args.budget)
+    pairs = [(user_id, challenge_id) for user_id in sample
+             for challenge_id in list(instance.get_user_data(user_id).challenges)[:1]]
+
+    timings['get_challenge_progress'] = measure(instance.get_challenge_progress, pairs, args.budget)
+    timings['get_active_challenges'] = measure(instance.get_active_challenges,
+                                               [(u,) for u in sample], args.budget)
+    mutate = measure if args.sync else measure_on_loop
+    timings['add_reps'] = mutate(instance.add_reps, [pair + (10,) for pair in pairs], args.budget)
+    # Challenge ids have one-second resolution, so every call goes to a different user
+    timings['create_challenge'] = mutate(
+        instance.create_challenge,
+        [(u, bot.ExerciseType.PUSHUPS, 1000, 30) for u in sample], args.budget)
+    # Snapshots still being written would compete with save_data
+    instance.storage.drain()
+    # Last, so lazy engines have the sampled users in memory to write
+    timings['save_data'] = measure(instance.save_data, repeat, args.budget)
+    instance.close()
+
+    return {
+        'users': users,
+        'generate_s': generated,
+        'startup_s': startup,
+        'operations': {name: summarize(timings[name]) for name in OPERATIONS},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='comma-separated user counts')
+    parser.add_argument('--storage', choices=('json', 'journal', 'sqlite', 'sharded'),
+                        default='json')
+    parser.add_argument('--challenges', type=int, default=2)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--calls', type=int, default=1000,
+                        help='maximum calls per operation')
+    parser.add_argument('--budget', type=float, default=10,
+                        help='seconds after which an operation stops early')
+    parser.add_argument('--sync', action='store_true',
+                        help='run create_challenge and add_reps outside an event loop')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = []
+    for users in sizes:
+        result = run_size(users, args)
+        results.append(result)
+        if not args.json:
+            print(f"{users:,} users x {args.challenges} challenges x {args.days} days, "
+                  f"{args.storage} storage, changes {'synchronous' if args.sync else 'on the loop'} "
+                  f"(import and load {result['startup_s']:.2f}s)")
+            for name in OPERATIONS:
+                r = result['operations'][name]
+                print(f"  {name:>22}: {r['mean_us']:12.1f} us mean  {r['p50_us']:12.1f} p50  "
+                      f"{r['p99_us']:12.1f} p99  ({r['calls']} calls)")
+        gc.collect()
+
+    if args.json:
+        print(json.dumps({'storage': args.storage, 'sync': args.sync, 'challenges': args.challenges,
+                          'days': args.days, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
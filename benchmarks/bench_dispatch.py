@@ -0,0 +1,107 @@
+"""Per-message dispatch overhead: the old if/elif chain vs the routing tables.
+
+Usage: python benchmarks/bench_dispatch.py [--messages 200000] [--json]
+
+Every route is pointed at a no-op handler so only the cost of picking the
+handler is measured, with metrics off (the default) and on. The message mix cycles through the six menu labels, the
+three conversation steps and unrouted text.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import time
+from types import SimpleNamespace
+
+from common import load_bot_module
+
+MENU_LABELS = ["🆕 New Challenge", "📊 My Challenges", "➕ Add Reps", "📈 Progress",
+               "⚙️ Settings", "📚 Exercise Guide"]
+
+
+async def noop(update, context):
+    pass
+
+
+async def legacy_dispatch(update, context):
+    """handle_message's routing before the tables, with no-op branches"""
+    message_text = update.message.text
+    user = update.effective_user
+    username = user.first_name or user.username or "User"
+    user_id = str(user.id)
+
+    if message_text == "🆕 New Challenge":
+        await noop(update, context)
+    elif message_text == "📊 My Challenges":
+        await noop(update, context)
+    elif message_text == "➕ Add Reps":
+        await noop(update, context)
+    elif message_text == "📈 Progress":
+        await noop(update, context)
+    elif message_text == "⚙️ Settings":
+        await noop(update, context)
+    elif message_text == "📚 Exercise Guide":
+        await noop(update, context)
+    elif context.user_data.get('challenge_step') == 'total_reps':
+        await noop(update, context)
+    elif context.user_data.get('challenge_step') == 'days':
+        await noop(update, context)
+    elif context.user_data.get('adding_reps'):
+        await noop(update, context)
+    else:
+        await noop(update, context)
+
+
+def message_mix():
+    """(update, context) pairs covering every route once"""
+    user = SimpleNamespace(id=42, first_name='Ann', username=None)
+    pairs = [(label, {}) for label in MENU_LABELS]
+    pairs += [('100', {'challenge_step': 'total_reps'}), ('30', {'challenge_step': 'days'}),
+              ('25', {'adding_reps': True}), ('hello', {})]
+    return [(SimpleNamespace(message=SimpleNamespace(text=text), effective_user=user),
+             SimpleNamespace(user_data=user_data)) for text, user_data in pairs]
+
+
+async def time_dispatch(dispatch, mix, messages):
+    rounds = max(1, messages // len(mix))
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for update, context in mix:
+            await dispatch(update, context)
+    return (time.perf_counter() - started) / (rounds * len(mix))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    bot = load_bot_module()
+    for routes in (bot.MENU_ROUTES, bot.STEP_ROUTES):
+        for key in routes:
+            routes[key] = noop
+    bot.handle_unrouted = noop
+    # handle_message without the metrics and per-user lock wrappers
+    table_dispatch = inspect.unwrap(bot.handle_message)
+
+    mix = message_mix()
+    results = {
+        'legacy_ns': asyncio.run(time_dispatch(legacy_dispatch, mix, args.messages)) * 1e9,
+        'table_ns': asyncio.run(time_dispatch(table_dispatch, mix, args.messages)) * 1e9,
+    }
+    bot.METRICS_PORT = 9100  # only read at call time here, nothing is served
+    results['table_with_metrics_ns'] = asyncio.run(time_dispatch(table_dispatch, mix, args.messages)) * 1e9
+    results['speedup'] = results['legacy_ns'] / results['table_ns']
+    if args.json:
+        print(json.dumps({'messages': args.messages, **results}, indent=2))
+        return
+    print(f"{args.messages:,} messages, {len(mix)} routes")
+    print(f"  if/elif chain: {results['legacy_ns']:7.0f} ns/message")
+    print(f"  route tables:  {results['table_ns']:7.0f} ns/message")
+    print(f"  with metrics:  {results['table_with_metrics_ns']:7.0f} ns/message")
+    print(f"  speedup: {results['speedup']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""End-to-end load test: the real bot process against the fake Bot API.
+
+Usage: python benchmarks/bench_load.py [--users 2000] [--concurrency 200]
+           [--mode polling|webhook] [--latency-ms 0] [--env STORAGE_MODE=sqlite ...] [--json]
+
+The bot is started exactly as in production (`main()` in its own process), with
+BOT_API_URL pointed at benchmarks/fake_bot_api.py running in this process and
+its data files in a scratch directory. Every simulated user walks through
+/start, New Challenge, exercise choice, reps, days, Add Reps, the challenge
+button, a rep count and Progress, waiting for the bot's answer to each step.
+Latency is measured from handing an update to the fake API until the bot's
+reply for that chat arrives. Memory is summed over the bot process and, with
+`--env WORKER_COUNT=n`, its worker processes.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import REPO_ROOT, BOT_MODULE
+from fake_bot_api import FakeBotAPI, callback_update, message_update
+
+FIRST_USER_ID = 10_000_000
+STEPS_PER_USER = 9
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def port_open(port):
+    with socket.socket() as sock:
+        return sock.connect_ex(('127.0.0.1', port)) == 0
+
+
+def rss_kib(pid, field='VmRSS'):
+    """Resident set size (or VmHWM, the peak) of a process from /proc, in KiB"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def process_tree(pid):
+    """pid and every process descended from it (a WORKER_COUNT dispatcher's workers)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The parent pid is the second field after the parenthesized command name
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    tree = [pid]
+    for member in tree:
+        tree.extend(children.get(member, []))
+    return tree
+
+
+def tree_rss_kib(pid, field='VmRSS'):
+    """rss_kib summed over a process and its descendants; for VmHWM, the sum of each one's peak"""
+    values = [rss_kib(member, field) for member in process_tree(pid)]
+    values = [value for value in values if value is not None]
+    return sum(values) if values else None
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class WebhookRejected(Exception):
+    """The bot answered a webhook POST with something other than 200"""
+
+
+async def user_session(api, user_id, latencies, timeout):
+    async def step(update):
+        started = time.perf_counter()
+        post = api.push_update(update)
+        # In webhook mode the POST is a task; the bot answers it once the update is queued
+        if post is not None:
+            status = await asyncio.wait_for(post, timeout)
+            if status != 200:
+                raise WebhookRejected(status)
+        reply = await asyncio.wait_for(api.next_reply(user_id), timeout)
+        latencies.append(time.perf_counter() - started)
+        return reply
+
+    await step(message_update(user_id, '/start'))
+    await step(message_update(user_id, '🆕 New Challenge'))
+    await step(callback_update(user_id, 'exercise_PUSHUPS'))
+    await step(message_update(user_id, '1000'))
+    await step(message_update(user_id, '30'))
+    reply = await step(message_update(user_id, '➕ Add Reps'))
+    await step(callback_update(user_id, reply['reply_markup']['inline_keyboard'][0][0]['callback_data']))
+    await step(message_update(user_id, '50'))
+    await step(message_update(user_id, '📈 Progress'))
+
+
+async def wait_until(predicate, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if process.poll() is not None:
+            raise RuntimeError(f"bot exited with {process.returncode} during startup")
+        if time.monotonic() > deadline:
+            raise RuntimeError("bot did not start in time")
+        await asyncio.sleep(0.05)
+
+
+async def run(args):
+    api = FakeBotAPI(latency_ms=args.latency_ms, track_replies=True)
+    url = await api.start()
+    workdir = tempfile.mkdtemp(prefix='fitness-load-')
+    env = dict(os.environ,
+               BOT_TOKEN='1:fake', BOT_API_URL=url,
+               DATA_FILE=os.path.join(workdir, 'data.json'),
+               SQLITE_FILE=os.path.join(workdir, 'data.db'),
+               SHARD_DIR=os.path.join(workdir, 'users'))
+    if args.mode == 'webhook':
+        port = free_port()
+        env.update(UPDATE_MODE='webhook', WEBHOOK_LISTEN='127.0.0.1', WEBHOOK_PORT=str(port),
+                   WEBHOOK_URL=f"http://127.0.0.1:{port}")
+    env.update(item.split('=', 1) for item in args.env)
+
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, BOT_MODULE + '.py')],
+                               env=env, cwd=workdir,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if args.mode == 'webhook':
+            await wait_until(lambda: api.webhook_url, process)
+        else:
+            await wait_until(lambda: api.calls.get('getUpdates'), process)
+        workers = int(env.get('WORKER_COUNT', '1'))
+        if workers > 1:
+            # The dispatcher polls before its workers finish starting
+            base_port = int(env.get('WORKER_BASE_PORT', '8600'))
+            await wait_until(lambda: all(port_open(base_port + i) for i in range(workers)), process)
+        rss_idle = tree_rss_kib(process.pid)
+
+        latencies = []
+        failures = 0
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def session(user_id):
+            nonlocal failures
+            async with semaphore:
+                try:
+                    await user_session(api, user_id, latencies, args.timeout)
+                except (asyncio.TimeoutError, KeyError, IndexError, WebhookRejected):
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(session(FIRST_USER_ID + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        processes = len(process_tree(process.pid))
+        rss_loaded = tree_rss_kib(process.pid)
+        rss_peak = tree_rss_kib(process.pid, 'VmHWM')
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        await api.stop()
+
+    return {
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'mode': args.mode,
+        'latency_ms': args.latency_ms,
+        'env': args.env,
+        'updates': len(latencies),
+        'failed_users': failures,
+        'webhook_errors': api.webhook_errors,
+        'seconds': elapsed,
+        'updates_per_second': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'processes': processes,
+        'rss_idle_mib': rss_idle / 1024 if rss_idle else None,
+        'rss_mib': rss_loaded / 1024 if rss_loaded else None,
+        'rss_peak_mib': rss_peak / 1024 if rss_peak else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help='users going through their flow at the same time')
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='polling')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='simulated Bot API round-trip for every call the bot makes')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds to wait for a single reply before giving up on a user')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra environment for the bot, e.g. CONCURRENT_UPDATES=64')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.users:,} users x {STEPS_PER_USER} steps, {args.concurrency} at a time, "
+          f"{args.mode}, {args.latency_ms:g} ms API latency {' '.join(args.env)}")
+    print(f"  {results['updates']:,} updates in {results['seconds']:.1f}s: "
+          f"{results['updates_per_second']:.0f} updates/s, {results['failed_users']} users failed"
+          + (f", {results['webhook_errors']} webhook POSTs rejected" if args.mode == 'webhook' else ''))
+    if results['updates']:
+        print(f"  latency: p50 {results['p50_ms']:.1f} ms, p99 {results['p99_ms']:.1f} ms")
+    if results['rss_mib']:
+        print(f"  bot RSS over {results['processes']} process(es): {results['rss_idle_mib']:.0f} MiB "
+              f"idle, {results['rss_mib']:.0f} MiB after the run, {results['rss_peak_mib']:.0f} MiB "
+              f"peak (sum of each process's peak)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Memory per user: plain dicts (the old in-memory model) vs slotted UserRecord.
+
+Usage: python benchmarks/bench_memory.py [--users 100000] [--challenges 2] [--days 30]
+
+Both models are built from the same JSON text; the figure reported is the memory
+still allocated once the JSON text and intermediate objects are released.
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from datetime import datetime
+
+from common import load_bot_module, stored_users
+
+DATE_FIELDS = ('start_date', 'target_date', 'completion_date')
+
+
+def dict_model(raw):
+    """What the bot held before UserRecord: decoded JSON with parsed dates"""
+    data = json.loads(raw)
+    for user in data.values():
+        for challenge in user['challenges'].values():
+            for field in DATE_FIELDS:
+                if field in challenge:
+                    challenge[field] = datetime.fromisoformat(challenge[field])
+    return data
+
+
+def measure(build, raw):
+    gc.collect()
+    tracemalloc.start()
+    model = build(raw)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return model, current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--challenges', type=int, default=2)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    bot = load_bot_module()
+    raw = json.dumps(stored_users(args.users, args.challenges, args.days))
+
+    def record_model(text):
+        return {user_id: bot.UserRecord.from_dict(user)
+                for user_id, user in json.loads(text).items()}
+
+    results = {}
+    for name, build in (('dict', dict_model), ('slots', record_model)):
+        model, current, peak = measure(build, raw)
+        results[name] = {
+            'bytes': current,
+            'bytes_per_user': current / args.users,
+            'peak_bytes': peak
+        }
+        del model
+
+    results['saving'] = 1 - results['slots']['bytes'] / results['dict']['bytes']
+    if args.json:
+        print(json.dumps({'users': args.users, 'challenges': args.challenges,
+                          'days': args.days, **results}, indent=2))
+        return
+    print(f"{args.users:,} users x {args.challenges} challenges x {args.days} days of history")
+    for name in ('dict', 'slots'):
+        r = results[name]
+        print(f"  {name:>5}: {r['bytes_per_user']:8.0f} B/user  "
+              f"({r['bytes'] / 2**20:7.1f} MiB retained, {r['peak_bytes'] / 2**20:7.1f} MiB peak)")
+    print(f"  saving: {results['saving']:.1%}")
+
+
+if __name__ == '__main__':
+    main()
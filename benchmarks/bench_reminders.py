@@ -0,0 +1,150 @@
+"""Full daily reminder sweep (send_daily_reminders) by population size.
+
+Usage: python benchmarks/bench_reminders.py [--sizes 10000,100000,1000000] [--challenges 2]
+           [--days 30] [--send-ms 0] [--workers 16] [--telegram-rate 30] [--window 3600] [--json]
+
+For every size, bot_instance is loaded with that many users with `--challenges`
+active challenges each, and send_daily_reminders runs over all of them with
+context.bot.send_message stubbed out (answering after `--send-ms`). The rate
+limits are lifted, so the run time is what the bot itself needs. Reported:
+
+- progress: BulkProgress over every active challenge, in reminder batches
+- texts: build_reminder_texts for every user (includes the progress pass)
+- run: the whole send_daily_reminders call, with its send throughput
+- peak memory: traced allocations during a second run (tracemalloc slows it
+  down, so its duration is not reported)
+
+Telegram only allows about 30 messages per second (`--telegram-rate`), so the
+projected duration is whichever is longer: the measured run or
+sent / telegram rate. A size fits when that projection stays inside
+`--window` seconds.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from common import load_bot_module, write_stored_users
+
+UNLIMITED_RATE = 1e9
+
+
+class StubBot:
+    """Stands in for context.bot: accepts every message after a fixed delay"""
+
+    def __init__(self, send_ms=0):
+        self.delay = send_ms / 1000
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent += 1
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def run_size(users, args):
+    workdir = tempfile.mkdtemp(prefix='fitness-bench-')
+    write_stored_users(os.path.join(workdir, 'data.json'), users, args.challenges, args.days)
+    bot = load_bot_module(workdir, WRITE_BEHIND_MS=0, REMINDER_WORKERS=args.workers,
+                          REMINDER_GLOBAL_RATE=UNLIMITED_RATE, REMINDER_CHAT_RATE=UNLIMITED_RATE)
+    instance = bot.bot_instance
+
+    user_ids = instance.reminder_user_ids()
+    challenges = [instance.user_data[user_id].challenges[challenge_id]
+                  for user_id in user_ids for challenge_id in instance.active_challenge_ids[user_id]]
+
+    started = time.perf_counter()
+    for batch in batches(challenges, bot.REMINDER_BATCH_SIZE):
+        bot.BulkProgress(batch)
+    progress = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for batch in batches(user_ids, bot.REMINDER_BATCH_SIZE):
+        bot.build_reminder_texts(batch)
+    texts = time.perf_counter() - started
+
+    stub = StubBot(args.send_ms)
+    context = SimpleNamespace(bot=stub, job=None)
+    report = asyncio.run(bot.send_daily_reminders(context))
+
+    # Second run on a fresh ledger, with allocation tracing
+    instance.delivery_ledger = bot.DeliveryLedger(os.path.join(workdir, 'traced.reminders'))
+    gc.collect()
+    tracemalloc.start()
+    asyncio.run(bot.send_daily_reminders(SimpleNamespace(bot=StubBot(args.send_ms), job=None)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    projected = max(report['duration'], report['sent'] / args.telegram_rate)
+    return {
+        'users': users,
+        'challenges': len(challenges),
+        'progress_s': progress,
+        'texts_s': texts,
+        'run_s': report['duration'],
+        'sent': report['sent'],
+        'failed': report['failed'],
+        'messages_per_second': report['per_second'],
+        'run_peak_bytes': peak,
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'projected_s': projected,
+        'fits_window': projected <= args.window,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma-separated user counts')
+    parser.add_argument('--challenges', type=int, default=2, help='active challenges per user')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--send-ms', type=float, default=0,
+                        help='time the stubbed send_message takes')
+    parser.add_argument('--workers', type=int, default=16, help='REMINDER_WORKERS for the run')
+    parser.add_argument('--telegram-rate', type=float, default=30,
+                        help='messages per second Telegram allows (REMINDER_GLOBAL_RATE in production)')
+    parser.add_argument('--window', type=float, default=3600,
+                        help='seconds the sweep has to finish in')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for users in (int(size) for size in args.sizes.split(',')):
+        r = run_size(users, args)
+        results.append(r)
+        gc.collect()
+        if args.json:
+            continue
+        print(f"{users:,} users, {r['challenges']:,} active challenges")
+        print(f"  progress {r['progress_s']:.2f}s, texts {r['texts_s']:.2f}s, "
+              f"run {r['run_s']:.2f}s ({r['messages_per_second']:.0f} msg/s, "
+              f"{r['sent']:,} sent, {r['failed']} failed)")
+        print(f"  peak {r['run_peak_bytes'] / 2**20:.0f} MiB traced during the run, "
+              f"{r['max_rss_bytes'] / 2**20:.0f} MiB max RSS")
+        print(f"  projected {r['projected_s']:.0f}s at the Telegram rate: "
+              f"{'fits' if r['fits_window'] else 'does NOT fit'} a {args.window:.0f}s window")
+
+    if args.json:
+        print(json.dumps({'challenges': args.challenges, 'days': args.days, 'send_ms': args.send_ms,
+                          'workers': args.workers, 'window': args.window, 'results': results},
+                         indent=2))
+        return
+    # Both the bot's own time and the rate-limited projection grow linearly with users
+    largest = results[-1]
+    print(f"Window is exhausted at about "
+          f"{largest['users'] * args.window / largest['projected_s']:,.0f} users")
+
+
+if __name__ == '__main__':
+    main()
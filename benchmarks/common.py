@@ -0,0 +1,90 @@
+"""Shared helpers for the benchmark scripts.
+
+The bot module reads its configuration from the environment at import time, so
+`load_bot_module` points every data file at a scratch directory before
+importing it; benchmarks never touch the real data files.
+"""
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_MODULE = 'SportChallangeDerevo_upgrade_bot'
+
+EXERCISES = ['push-ups', 'squats', 'pull-ups', 'sit-ups', 'burpees', 'planks (seconds)']
+
+
+def load_bot_module(workdir=None, **env):
+    """Import the bot module with its data files inside `workdir`"""
+    workdir = workdir or tempfile.mkdtemp(prefix='fitness-bench-')
+    os.environ['DATA_FILE'] = os.path.join(workdir, 'data.json')
+    os.environ['SQLITE_FILE'] = os.path.join(workdir, 'data.db')
+    os.environ['SHARD_DIR'] = os.path.join(workdir, 'users')
+    for key, value in env.items():
+        os.environ[key] = str(value)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    sys.modules.pop(BOT_MODULE, None)
+    module = importlib.import_module(BOT_MODULE)
+    module.logger.setLevel('WARNING')
+    return module
+
+
+def stored_user(rng, challenges=2, days=30, now=None):
+    """A user record in the stored (JSON) format with `days` of history per challenge"""
+    now = now or datetime.now()
+    user = {
+        'challenges': {},
+        'timezone': rng.choice(['UTC', 'Europe/Kyiv', 'America/New_York', 'Asia/Tokyo']),
+        'reminder_times': {'morning': '09:00', 'evening': '20:00'},
+        'reminders_enabled': True
+    }
+    for i in range(challenges):
+        exercise = rng.choice(EXERCISES)
+        target_days = rng.choice([30, 60, 100, 365])
+        start = now - timedelta(days=days - 1, seconds=rng.randrange(86400))
+        records = {}
+        for day in range(days):
+            if rng.random() < 0.8:
+                records[(start + timedelta(days=day)).strftime('%Y-%m-%d')] = rng.randrange(5, 120)
+        total_reps = target_days * rng.choice([20, 50, 100])
+        challenge_id = f"{exercise.split()[0].upper()}_{start.strftime('%Y%m%d_%H%M%S')}_{i}"
+        user['challenges'][challenge_id] = {
+            'id': challenge_id,
+            'exercise': exercise,
+            'total_reps': total_reps,
+            'target_days': target_days,
+            'current_reps': sum(records.values()),
+            'start_date': start.isoformat(),
+            'target_date': (start + timedelta(days=target_days)).isoformat(),
+            'status': 'active',
+            'daily_records': records,
+            'daily_target': total_reps / target_days
+        }
+    return user
+
+
+def stored_users(count, challenges=2, days=30, seed=1):
+    """`count` stored users keyed by numeric string ids"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    return {str(100000000 + i): stored_user(rng, challenges, days, now) for i in range(count)}
+
+
+def write_stored_users(path, count, challenges=2, days=30, seed=1):
+    """Write the same data as `stored_users` as a plain JSON data file, one user at a
+    time so large populations never exist in memory as a whole"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    with open(path, 'w') as f:
+        f.write('{')
+        for i in range(count):
+            if i:
+                f.write(', ')
+            f.write(f'"{100000000 + i}": ')
+            json.dump(stored_user(rng, challenges, days, now), f)
+        f.write('}')
@@ -0,0 +1,257 @@
+"""A local stand-in for the Telegram Bot API.
+
+Serves just enough of the Bot API over plain HTTP for the bot to run against
+it: getMe, getUpdates (long polling), sendMessage, editMessageText,
+answerCallbackQuery and the webhook methods. Whatever the bot sends is
+recorded. Updates fed in with `push_update` are queued for getUpdates, or
+POSTed to the bot's webhook once it has registered one.
+
+Usage: python benchmarks/fake_bot_api.py [--port 8081] [--latency-ms 40]
+then start the bot with BOT_API_URL=http://127.0.0.1:8081/bot BOT_TOKEN=1:fake.
+
+While running from the command line, POST an update (or a list of them) to
+/_push to inject it and GET /_stats for call counts.
+"""
+import argparse
+import asyncio
+import json
+import ssl
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot',
+            'can_join_groups': True, 'can_read_all_group_messages': False,
+            'supports_inline_queries': False}
+
+
+def message_update(user_id, text, first_name='User'):
+    """A private-chat text message update from `user_id`; '/...' text is a command"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': first_name}
+    message = {'message_id': 1, 'date': int(time.time()), 'text': text, 'from': user,
+               'chat': {'id': user_id, 'type': 'private', 'first_name': first_name}}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0,
+                                'length': len(text.split()[0])}]
+    return {'message': message}
+
+
+def callback_update(user_id, data, first_name='User'):
+    """An inline button press by `user_id` on a message in their private chat"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': first_name}
+    message = {'message_id': 1, 'date': int(time.time()), 'text': '-', 'from': BOT_USER,
+               'chat': {'id': user_id, 'type': 'private', 'first_name': first_name}}
+    return {'callback_query': {'id': str(user_id), 'from': user, 'chat_instance': str(user_id),
+                               'data': data, 'message': message}}
+
+
+class FakeBotAPI:
+    """In-process Bot API server; see the module docstring"""
+
+    def __init__(self, latency_ms=0, track_replies=False):
+        self.latency = latency_ms / 1000
+        # When set, messages sent or edited per chat are also queued for `next_reply`
+        self.track_replies = track_replies
+        self._replies = {}
+        self.calls = {}
+        self.sent = []
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.webhook_errors = 0
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._new_updates = asyncio.Event()
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start serving; returns the base URL to use as BOT_API_URL"""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}/bot"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def next_reply(self, chat_id):
+        """Params of the next message sent or edited in a chat (needs track_replies)"""
+        return await self._reply_queue(chat_id).get()
+
+    def _reply_queue(self, chat_id):
+        queue = self._replies.get(chat_id)
+        if queue is None:
+            queue = self._replies[chat_id] = asyncio.Queue()
+        return queue
+
+    def _record(self, api_method, params):
+        self.sent.append((api_method, params, time.monotonic()))
+        if self.track_replies:
+            self._reply_queue(int(params.get('chat_id', 0))).put_nowait(params)
+
+    def push_update(self, update):
+        """Hand an update to the bot, numbering it if needed"""
+        update = dict(update)
+        update.setdefault('update_id', self._next_update_id)
+        self._next_update_id = update['update_id'] + 1
+        if self.webhook_url:
+            return asyncio.ensure_future(self.post_webhook(update))
+        self._updates.append(update)
+        self._new_updates.set()
+        return None
+
+    async def post_webhook(self, update):
+        """POST one update to the registered webhook; returns the HTTP status"""
+        url = urlsplit(self.webhook_url)
+        body = json.dumps(update).encode()
+        headers = [f"POST {url.path or '/'} HTTP/1.1", f"Host: {url.netloc}",
+                   'Content-Type: application/json', f"Content-Length: {len(body)}",
+                   'Connection: close']
+        if self.webhook_secret:
+            headers.append(f"X-Telegram-Bot-Api-Secret-Token: {self.webhook_secret}")
+        try:
+            reader, writer = await asyncio.open_connection(
+                url.hostname, url.port or (443 if url.scheme == 'https' else 80),
+                ssl=ssl.create_default_context() if url.scheme == 'https' else None)
+            writer.write('\r\n'.join(headers).encode() + b'\r\n\r\n' + body)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            writer.close()
+        except (OSError, IndexError, ValueError):
+            status = 0
+        if status != 200:
+            self.webhook_errors += 1
+        return status
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                http_method, target, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, result = await self._handle(http_method, urlsplit(target).path,
+                                                    headers.get('content-type', ''), body)
+                payload = json.dumps(result).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n"
+                    .encode() + payload)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # CancelledError: open keep-alive connections when the server stops
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, http_method, path, content_type, body):
+        if path == '/_push':
+            updates = json.loads(body)
+            for update in updates if isinstance(updates, list) else [updates]:
+                self.push_update(update)
+            return 200, {'ok': True}
+        if path == '/_stats':
+            return 200, {'calls': self.calls, 'sent': len(self.sent),
+                         'webhook_errors': self.webhook_errors}
+
+        api_method = path.rsplit('/', 1)[-1]
+        params = self._params(content_type, body)
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        handler = getattr(self, f"api_{api_method}", None)
+        if handler is None:
+            return 200, {'ok': True, 'result': True}
+        if api_method != 'getUpdates' and self.latency:
+            await asyncio.sleep(self.latency)
+        return 200, {'ok': True, 'result': await handler(params)}
+
+    @staticmethod
+    def _params(content_type, body):
+        if not body:
+            return {}
+        if content_type.startswith('application/json'):
+            return json.loads(body)
+        params = dict(parse_qsl(body.decode(), keep_blank_values=True))
+        # Nested values (reply_markup and the like) arrive JSON-encoded
+        for key, value in params.items():
+            if value[:1] in ('{', '['):
+                params[key] = json.loads(value)
+        return params
+
+    def _message(self, params):
+        self._next_message_id += 1
+        chat_id = int(params.get('chat_id', 0))
+        return {'message_id': self._next_message_id, 'date': int(time.time()), 'from': BOT_USER,
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+
+    async def api_getMe(self, params):
+        return BOT_USER
+
+    async def api_getUpdates(self, params):
+        offset = int(params.get('offset', 0))
+        self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get('timeout', 0)))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get('limit', 100))]
+
+    async def api_setWebhook(self, params):
+        self.webhook_url = params.get('url') or None
+        self.webhook_secret = params.get('secret_token')
+        pending, self._updates = self._updates, []
+        for update in pending:
+            self.push_update(update)
+        return True
+
+    async def api_deleteWebhook(self, params):
+        self.webhook_url = None
+        return True
+
+    async def api_getWebhookInfo(self, params):
+        return {'url': self.webhook_url or '', 'has_custom_certificate': False,
+                'pending_update_count': len(self._updates)}
+
+    async def api_sendMessage(self, params):
+        self._record('sendMessage', params)
+        return self._message(params)
+
+    async def api_editMessageText(self, params):
+        self._record('editMessageText', params)
+        return self._message(params)
+
+    async def api_answerCallbackQuery(self, params):
+        return True
+
+
+async def serve(args):
+    api = FakeBotAPI(latency_ms=args.latency_ms)
+    url = await api.start(args.host, args.port)
+    print(f"Fake Bot API listening, use BOT_API_URL={url}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='delay before answering each call, like a Telegram round-trip')
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
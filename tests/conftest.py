@@ -0,0 +1,35 @@
+"""Shared fixtures for the test suite.
+
+The bot module reads its configuration from the environment and builds
+bot_instance at import time, so tests import it afresh with every data file
+inside tmp_path. Importing it again over the same files is how a test
+restarts the bot, e.g. after a simulated crash.
+"""
+import importlib
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_MODULE = 'SportChallangeDerevo_upgrade_bot'
+
+
+@pytest.fixture
+def load_bot(tmp_path, monkeypatch):
+    """Import the bot module with its data files in tmp_path; extra keyword args set env vars"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(REPO_ROOT)
+    monkeypatch.setenv('DATA_FILE', str(tmp_path / 'data.json'))
+    monkeypatch.setenv('SQLITE_FILE', str(tmp_path / 'data.db'))
+    monkeypatch.setenv('SHARD_DIR', str(tmp_path / 'users'))
+    monkeypatch.setenv('WRITE_BEHIND_MS', '0')
+
+    def load(**env):
+        for key, value in env.items():
+            monkeypatch.setenv(key, str(value))
+        sys.modules.pop(BOT_MODULE, None)
+        return importlib.import_module(BOT_MODULE)
+
+    yield load
+    sys.modules.pop(BOT_MODULE, None)
@@ -0,0 +1,50 @@
+"""Reminder delivery ledger: resuming after a restart."""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def ledger_module(load_bot):
+    return load_bot()
+
+
+def utc_day(bot, days_ago=0):
+    return (datetime.now(bot.pytz.utc) - timedelta(days=days_ago)).strftime('%Y-%m-%d')
+
+
+def test_deliveries_survive_a_restart(ledger_module, tmp_path):
+    bot = ledger_module
+    path = str(tmp_path / 'ledger')
+    ledger = bot.DeliveryLedger(path)
+    ledger.mark_delivered('1', 'morning', utc_day(bot))
+    ledger.mark_minute(540)
+    ledger.mark_run('evening', utc_day(bot), 'started')
+
+    resumed = bot.DeliveryLedger(path)
+    assert resumed.is_delivered('1', 'morning', utc_day(bot))
+    assert not resumed.is_delivered('1', 'evening', utc_day(bot))
+    assert resumed.last_minute == 540
+    assert resumed.unfinished_runs() == [('evening', utc_day(bot))]
+
+
+def test_torn_last_line_is_ignored(ledger_module, tmp_path):
+    bot = ledger_module
+    path = tmp_path / 'ledger'
+    bot.DeliveryLedger(str(path)).mark_delivered('1', 'morning', utc_day(bot))
+    with open(path, 'a') as f:
+        f.write('{"u":"2","s":"mor')
+
+    resumed = bot.DeliveryLedger(str(path))
+    assert resumed.delivered == {('1', 'morning', utc_day(bot))}
+
+
+def test_entries_older_than_yesterday_are_dropped(ledger_module, tmp_path):
+    bot = ledger_module
+    path = str(tmp_path / 'ledger')
+    ledger = bot.DeliveryLedger(path)
+    ledger.mark_delivered('1', 'morning', utc_day(bot, 1))
+    ledger.mark_delivered('2', 'morning', utc_day(bot, 3))
+
+    resumed = bot.DeliveryLedger(path)
+    assert resumed.delivered == {('1', 'morning', utc_day(bot, 1))}
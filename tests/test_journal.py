@@ -0,0 +1,73 @@
+"""Journal storage: replay after a crash, compaction and torn records."""
+import json
+from datetime import date
+
+
+def start_challenge(bot, user_id='1'):
+    return bot.bot_instance.create_challenge(user_id, bot.ExerciseType.PUSHUPS, 1000, 30)
+
+
+def test_replays_changes_after_crash(load_bot):
+    bot = load_bot(STORAGE_MODE='journal')
+    challenge_id = start_challenge(bot)
+    bot.bot_instance.add_reps('1', challenge_id, 25)
+    bot.bot_instance.add_reps('1', challenge_id, 15)
+
+    # No close(): the process died with the changes only in the journal
+    bot = load_bot(STORAGE_MODE='journal')
+    challenge = bot.bot_instance.user_data['1'].challenges[challenge_id]
+    assert challenge.current_reps == 40
+    assert challenge.reps_on(date.today()) == 40
+
+
+def test_replay_folds_journal_into_snapshot(load_bot, tmp_path):
+    bot = load_bot(STORAGE_MODE='journal')
+    challenge_id = start_challenge(bot)
+    bot.bot_instance.add_reps('1', challenge_id, 10)
+
+    bot = load_bot(STORAGE_MODE='journal')
+    assert (tmp_path / 'data.json.journal').read_text() == ''
+    snapshot = bot.JsonStorage(str(tmp_path / 'data.json')).load()
+    assert snapshot['1']['challenges'][challenge_id]['current_reps'] == 10
+
+
+def test_compacts_every_n_records(load_bot, tmp_path):
+    bot = load_bot(STORAGE_MODE='journal', JOURNAL_COMPACT_EVERY=3)
+    journal = tmp_path / 'data.json.journal'
+    # 'user' and 'challenge' records, then the 'reps' record triggers compaction
+    challenge_id = start_challenge(bot)
+    assert len(journal.read_text().splitlines()) == 2
+    bot.bot_instance.add_reps('1', challenge_id, 5)
+    assert journal.read_text() == ''
+
+    bot.bot_instance.add_reps('1', challenge_id, 5)
+    assert len(journal.read_text().splitlines()) == 1
+    bot = load_bot(STORAGE_MODE='journal', JOURNAL_COMPACT_EVERY=3)
+    assert bot.bot_instance.user_data['1'].challenges[challenge_id].current_reps == 10
+
+
+def test_torn_last_record_is_skipped(load_bot, tmp_path):
+    bot = load_bot(STORAGE_MODE='journal')
+    challenge_id = start_challenge(bot)
+    bot.bot_instance.add_reps('1', challenge_id, 30)
+    with open(tmp_path / 'data.json.journal', 'a') as f:
+        f.write('{"op":"reps","u":"1","c":')
+
+    bot = load_bot(STORAGE_MODE='journal')
+    assert bot.bot_instance.user_data['1'].challenges[challenge_id].current_reps == 30
+
+
+def test_replaying_a_record_twice_is_harmless(load_bot, tmp_path):
+    bot = load_bot(STORAGE_MODE='journal')
+    challenge_id = start_challenge(bot)
+    bot.bot_instance.add_reps('1', challenge_id, 30)
+    bot.bot_instance.add_reps('1', challenge_id, 20)
+    records = [json.loads(line) for line in (tmp_path / 'data.json.journal').read_text().splitlines()]
+
+    once, twice = {}, {}
+    for record in records:
+        bot.apply_journal_record(once, record)
+    for record in records + records:
+        bot.apply_journal_record(twice, record)
+    assert once == twice
+    assert once['1']['challenges'][challenge_id]['current_reps'] == 50
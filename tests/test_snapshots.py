@@ -0,0 +1,71 @@
+"""Checksummed snapshots: generations, fallback on corruption and the writer thread."""
+import asyncio
+import json
+
+
+def add_reps(bot, reps_list):
+    instance = bot.bot_instance
+    challenge_id = instance.create_challenge('1', bot.ExerciseType.PUSHUPS, 1000, 30)
+    for reps in reps_list:
+        instance.add_reps('1', challenge_id, reps)
+    return challenge_id
+
+
+def current_reps(bot, challenge_id):
+    return bot.bot_instance.user_data['1'].challenges[challenge_id].current_reps
+
+
+def header(path):
+    with open(path, 'rb') as f:
+        return f.readline().decode().split()
+
+
+def test_keeps_older_generations(load_bot, tmp_path):
+    bot = load_bot(SNAPSHOT_GENERATIONS=2)
+    add_reps(bot, [1, 1, 1])
+    names = sorted(path.name for path in tmp_path.iterdir() if path.name.startswith('data.json'))
+    assert names == ['data.json', 'data.json.1', 'data.json.2']
+    generations = [int(header(tmp_path / name)[1].split('=')[1]) for name in names]
+    assert generations[0] > generations[1] > generations[2]
+
+
+def test_falls_back_to_previous_generation_on_checksum_mismatch(load_bot, tmp_path):
+    bot = load_bot()
+    challenge_id = add_reps(bot, [10, 5])
+    data_file = tmp_path / 'data.json'
+    raw = data_file.read_bytes()
+    tampered = raw.replace(b'"current_reps": 15', b'"current_reps": 99')
+    assert tampered != raw
+    data_file.write_bytes(tampered)
+
+    bot = load_bot()
+    assert current_reps(bot, challenge_id) == 10
+
+
+def test_falls_back_on_truncated_snapshot(load_bot, tmp_path):
+    bot = load_bot()
+    challenge_id = add_reps(bot, [10, 5])
+    data_file = tmp_path / 'data.json'
+    data_file.write_bytes(data_file.read_bytes()[:-20])
+
+    bot = load_bot()
+    assert current_reps(bot, challenge_id) == 10
+
+
+def test_loads_plain_json_from_before_checksums(load_bot, tmp_path):
+    (tmp_path / 'data.json').write_text(json.dumps({'7': {'challenges': {}}}))
+    bot = load_bot()
+    assert '7' in bot.bot_instance.user_data
+
+
+def test_writes_on_the_loop_reach_disk_after_close(load_bot):
+    bot = load_bot()
+
+    async def burst():
+        return add_reps(bot, [1] * 20)
+
+    challenge_id = asyncio.run(burst())
+    bot.bot_instance.close()
+
+    bot = load_bot()
+    assert current_reps(bot, challenge_id) == 20
@@ -0,0 +1,75 @@
+"""Worker sharding: the hash ring, rebalancing data files and delivery ledgers."""
+import json
+
+import pytest
+
+USERS = [str(100000 + i) for i in range(200)]
+STORAGE_MODES = ['json', 'journal', 'sqlite', 'sharded']
+
+
+def load_with_users(load_bot, tmp_path, **env):
+    """The bot module started over a plain data file holding USERS"""
+    users = {user_id: {'challenges': {}, 'timezone': 'UTC'} for user_id in USERS}
+    (tmp_path / 'data.json').write_text(json.dumps(users))
+    bot = load_bot(**env)
+    bot.bot_instance.close()
+    return bot
+
+
+def stored(bot, worker):
+    storage = bot.create_storage(worker, write_behind=False)
+    users = bot.load_all_users(storage)
+    # Snapshot engines would save the empty dict on close
+    if storage.lazy:
+        storage.close({})
+    return set(users)
+
+
+def test_ring_is_stable_and_moves_only_to_new_workers(load_bot):
+    bot = load_bot()
+    three, four = bot.HashRing(3), bot.HashRing(4)
+    assert [three.worker_for(u) for u in USERS] == [bot.HashRing(3).worker_for(u) for u in USERS]
+    assert {three.worker_for(u) for u in USERS} == {0, 1, 2}
+    moved = [u for u in USERS if three.worker_for(u) != four.worker_for(u)]
+    assert moved and all(four.worker_for(u) == 3 for u in moved)
+    assert len(moved) < len(USERS) / 2
+
+
+@pytest.mark.parametrize('mode', STORAGE_MODES)
+def test_rebalance_splits_and_merges_without_losing_users(load_bot, tmp_path, mode):
+    bot = load_with_users(load_bot, tmp_path, STORAGE_MODE=mode)
+    ring = bot.HashRing(3)
+
+    bot.rebalance_workers(1, 3)
+    for worker in range(3):
+        assert stored(bot, worker) == {u for u in USERS if ring.worker_for(u) == worker}
+
+    bot.rebalance_workers(3, 1)
+    assert stored(bot, 0) == set(USERS)
+    assert not stored(bot, 1) and not stored(bot, 2)
+
+
+def test_single_process_start_merges_worker_files(load_bot, tmp_path):
+    bot = load_with_users(load_bot, tmp_path)
+    bot.split_for_workers(2)
+    assert (tmp_path / 'data.json.workers').read_text() == '2'
+
+    bot = load_bot(WORKER_COUNT=1)
+    assert set(bot.bot_instance.user_data) == set(USERS)
+    assert (tmp_path / 'data.json.workers').read_text() == '1'
+
+
+def test_ledger_entries_follow_moved_users(load_bot, tmp_path):
+    bot = load_with_users(load_bot, tmp_path)
+    day = bot.datetime.now(bot.pytz.utc).strftime('%Y-%m-%d')
+    ledger = bot.DeliveryLedger(bot.worker_path(bot.REMINDER_LEDGER_FILE, 0))
+    for user_id in USERS:
+        ledger.mark_delivered(user_id, 'morning', day)
+
+    bot.rebalance_workers(1, 2)
+    ring = bot.HashRing(2)
+    moved = {u for u in USERS if ring.worker_for(u) == 1}
+    target = bot.DeliveryLedger(bot.worker_path(bot.REMINDER_LEDGER_FILE, 1))
+    assert moved
+    assert {user_id for user_id, _, _ in target.delivered} == moved
+    assert all(target.is_delivered(u, 'morning', day) for u in moved)